@@ -0,0 +1,45 @@
+import argparse
+import json
+import sys
+
+METRICS = ['p50_ms', 'p95_ms', 'p99_ms']
+
+
+def compare(baseline : dict, current : dict, threshold : float):
+    regressions = []
+    print(f"baseline : {baseline.get('commit')}  current : {current.get('commit')}")
+    print(f"throughput : {baseline['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} req/s")
+    print(f"{'route':<32}" + ''.join(f'{metric:>22}' for metric in METRICS))
+    for label in sorted(set(baseline['routes']) | set(current['routes'])):
+        old, new = baseline['routes'].get(label), current['routes'].get(label)
+        if old is None or new is None:
+            print(f"{label:<32}{'only in ' + ('current' if old is None else 'baseline'):>22}")
+            continue
+        cells = []
+        for metric in METRICS:
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            flag = ' !' if change > threshold else '  '
+            if change > threshold:
+                regressions.append((label, metric, change))
+            cells.append(f'{old[metric]:.1f}->{new[metric]:.1f} {change:+.0%}{flag}')
+        print(f'{label:<32}' + ''.join(f'{cell:>22}' for cell in cells))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type = float, default = 0.10, help = 'Relative slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f'\n{len(regressions)} regressions above {args.threshold:.0%}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import accumulate
+from sqlalchemy import insert
+from benchmarks.search import make_words
+from models.cart import CartItem
+from models.order import Order, OrderItem
+from models.products import Product
+from models.user import User
+from utils.auth_utils import get_password_hash
+
+BENCH_PASSWORD = 'benchmark'
+ORDER_STATUSES = ['completed'] * 7 + ['cancelled', 'failed', 'pending']
+
+
+class DatasetConfig:
+    def __init__(self, users : int = 1000, products : int = 10000, max_cart_items : int = 8,
+                 orders_per_user : float = 3.0, admins : int = 5, chunk_size : int = 5000, seed : int = 42):
+        self.users = users
+        self.products = products
+        self.max_cart_items = max_cart_items
+        self.orders_per_user = orders_per_user
+        self.admins = admins
+        self.chunk_size = chunk_size
+        self.seed = seed
+
+
+def chunks(rows, size : int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def insert_rows(connection, table, rows, chunk_size : int):
+    total = 0
+    for chunk in chunks(rows, chunk_size):
+        connection.execute(insert(table), chunk)
+        total += len(chunk)
+    return total
+
+def user_rows(config : DatasetConfig):
+    password = get_password_hash(BENCH_PASSWORD)
+    for id in range(1, config.users + 1):
+        yield {
+            'id' : id,
+            'username' : f'user{id}',
+            'email' : f'user{id}@bench.test',
+            'email_normalized' : f'user{id}@bench.test',
+            'password' : password,
+            'isadmin' : id <= config.admins
+        }
+
+def product_rows(config : DatasetConfig, rng : random.Random, words : list[str]):
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(words))))
+    for id in range(1, config.products + 1):
+        name = ' '.join(rng.choices(words, cum_weights = cum_weights, k = 2))[:32]
+        description = ' '.join(rng.choices(words, cum_weights = cum_weights, k = 12))[:256]
+        price = Decimal(str(round(min(rng.lognormvariate(3, 1), 999999), 2)))
+        yield {'id' : id, 'name' : name, 'description' : description, 'price' : price}
+
+def popular_products(config : DatasetConfig, rng : random.Random, k : int):
+    picked = set()
+    while len(picked) < min(k, config.products):
+        picked.add(min(int(rng.paretovariate(1.2)), config.products))
+    return picked
+
+def cart_rows(config : DatasetConfig, rng : random.Random, prices : dict[int, Decimal]):
+    for user_id in range(1, config.users + 1):
+        for product_id in popular_products(config, rng, rng.randint(0, config.max_cart_items)):
+            yield {'user_id' : user_id, 'product_id' : product_id, 'quantity' : rng.randint(1, 5), 'unit_price' : prices[product_id]}
+
+def order_rows(config : DatasetConfig, rng : random.Random, prices : dict[int, Decimal]):
+    now = datetime.now(timezone.utc)
+    order_id = 0
+    orders, items = [], []
+    for user_id in range(1, config.users + 1):
+        for _ in range(int(rng.expovariate(1 / config.orders_per_user))):
+            order_id += 1
+            lines = [(product_id, rng.randint(1, 3)) for product_id in popular_products(config, rng, rng.randint(1, 6))]
+            orders.append({
+                'id' : order_id,
+                'user_id' : user_id,
+                'created_at' : now - timedelta(seconds = rng.randint(0, 365 * 86400)),
+                'total_price' : sum(prices[product_id] * quantity for product_id, quantity in lines),
+                'paypal_order_id' : f'SEED{order_id:012d}',
+                'status' : rng.choice(ORDER_STATUSES)
+            })
+            items.extend({'order_id' : order_id, 'product_id' : product_id, 'quantity' : quantity, 'unit_price' : prices[product_id]} for product_id, quantity in lines)
+            if len(orders) >= config.chunk_size:
+                yield orders, items
+                orders, items = [], []
+    if orders:
+        yield orders, items
+
+def generate(engine, config : DatasetConfig):
+    rng = random.Random(config.seed)
+    words = make_words(rng, 2000)
+    counts = {}
+    with engine.begin() as connection:
+        counts['users'] = insert_rows(connection, User.__table__, user_rows(config), config.chunk_size) # type: ignore
+        products = list(product_rows(config, rng, words))
+        prices = {row['id'] : row['price'] for row in products}
+        counts['products'] = insert_rows(connection, Product.__table__, products, config.chunk_size) # type: ignore
+        counts['cart_items'] = insert_rows(connection, CartItem.__table__, cart_rows(config, rng, prices), config.chunk_size) # type: ignore
+        counts['orders'] = counts['order_items'] = 0
+        for orders, items in order_rows(config, rng, prices):
+            counts['orders'] += insert_rows(connection, Order.__table__, orders, config.chunk_size) # type: ignore
+            counts['order_items'] += insert_rows(connection, OrderItem.__table__, items, config.chunk_size) # type: ignore
+    return counts
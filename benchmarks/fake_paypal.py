@@ -0,0 +1,56 @@
+import asyncio
+import random
+from itertools import count
+import httpx
+
+
+class FakePayPal:
+    def __init__(self, latency : float = 0.0, failure_rate : float = 0.0, seed : int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.orders : dict[str, dict] = {}
+        self.captures : dict[str, dict] = {}
+        self.requests = 0
+        self._ids = count(1)
+        self._random = random.Random(seed)
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request : httpx.Request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            return httpx.Response(503, json = {'name' : 'SERVICE_UNAVAILABLE'})
+
+        path = request.url.path
+        if path == '/v1/oauth2/token':
+            return httpx.Response(200, json = {'access_token' : 'fake-token', 'token_type' : 'Bearer', 'expires_in' : 32400})
+        if path == '/v2/checkout/orders' and request.method == 'POST':
+            paypal_order_id = f'FAKE{next(self._ids):012d}'
+            self.orders[paypal_order_id] = {'status' : 'CREATED'}
+            return httpx.Response(201, json = {
+                'id' : paypal_order_id,
+                'status' : 'CREATED',
+                'links' : [
+                    {'rel' : 'approve', 'href' : f'https://paypal.test/checkoutnow?token={paypal_order_id}'}
+                ]
+            })
+        if path.endswith('/capture') and request.method == 'POST':
+            paypal_order_id = path.split('/')[-2]
+            order = self.orders.get(paypal_order_id)
+            if order is None:
+                return httpx.Response(404, json = {'name' : 'RESOURCE_NOT_FOUND'})
+            # a repeated PayPal-Request-Id replays the first capture, like the real API
+            request_id = request.headers.get('PayPal-Request-Id')
+            if request_id in self.captures:
+                return httpx.Response(201, json = self.captures[request_id])
+            if order['status'] == 'COMPLETED':
+                return httpx.Response(422, json = {'name' : 'UNPROCESSABLE_ENTITY', 'details' : [{'issue' : 'ORDER_ALREADY_CAPTURED'}]})
+            order['status'] = 'COMPLETED'
+            capture = {'id' : paypal_order_id, 'status' : 'COMPLETED'}
+            if request_id:
+                self.captures[request_id] = capture
+            return httpx.Response(201, json = capture)
+        return httpx.Response(404, json = {'name' : 'RESOURCE_NOT_FOUND'})
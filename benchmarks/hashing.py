@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+from time import perf_counter
+from utils.hashing import HashingPool, hash_password, verify_and_update
+
+
+async def run(workers : int, logins : int):
+    pool = HashingPool(workers, logins)
+    hashed = hash_password('benchmark-password')
+    pool.start()
+    await asyncio.gather(*(pool.run(verify_and_update, 'benchmark-password', hashed) for _ in range(workers)))
+    start = perf_counter()
+    await asyncio.gather(*(pool.run(verify_and_update, 'benchmark-password', hashed) for _ in range(logins)))
+    elapsed = perf_counter() - start
+    pool.shutdown()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure bcrypt logins per second on the hashing pool')
+    parser.add_argument('--workers', type = int, default = 1)
+    parser.add_argument('--logins', type = int, default = 100)
+    args = parser.parse_args()
+
+    elapsed = asyncio.run(run(args.workers, args.logins))
+    per_second = args.logins / elapsed
+    print(f'workers : {args.workers}, logins : {args.logins}, elapsed : {elapsed:.2f}s')
+    print(f'logins/s : {per_second:.1f}, logins/s per core : {per_second / args.workers:.1f}')
+
+if __name__ == '__main__':
+    main()
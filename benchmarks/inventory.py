@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import os
+import tempfile
+from decimal import Decimal
+from time import perf_counter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = 'Run concurrent checkouts against one product and check that stock is never oversold')
+    parser.add_argument('--database-url', default = None, help = 'Defaults to a fresh SQLite file in a temp directory')
+    parser.add_argument('--stock', type = int, default = 200)
+    parser.add_argument('--checkouts', type = int, default = 500)
+    parser.add_argument('--concurrency', type = int, default = 100)
+    parser.add_argument('--quantity', type = int, default = 1, help = 'Units of the product in each checkout')
+    return parser.parse_args()
+
+async def run(args):
+    from sqlmodel import Session, delete, func, select
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    from db.database import async_engine, create_db, engine
+    from models.order import Order, OrderItem, OrderStatus
+    from models.products import Product
+    from models.user import User
+    from utils.inventory import InsufficientStock, reserve_stock
+
+    create_db()
+    with Session(engine) as session:
+        session.exec(delete(OrderItem)) # type: ignore
+        session.exec(delete(Order)) # type: ignore
+        user = User(username = 'inventory-bench', email = 'inventory@bench.test', password = '-')
+        product = Product(name = 'inventory-bench', description = 'inventory benchmark', price = Decimal('9.99'), stock = args.stock)
+        session.add_all([user, product])
+        session.commit()
+        user_id, product_id = user.id, product.id
+
+    sold = rejected = errors = 0
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    # the same steps as create_paypal_order without PayPal: pending order, its items, then the reservation
+    async def checkout():
+        nonlocal sold, rejected, errors
+        async with semaphore, AsyncSession(async_engine, expire_on_commit = False) as session:
+            start = perf_counter()
+            try:
+                order = Order(user_id = user_id, total_price = Decimal('9.99') * args.quantity, status = OrderStatus.pending) # type: ignore
+                session.add(order)
+                await session.flush()
+                session.add(OrderItem(order_id = order.id, product_id = product_id, quantity = args.quantity)) # type: ignore
+                await session.flush()
+                await reserve_stock(session, order.id) # type: ignore
+                await session.commit()
+                sold += args.quantity
+            except InsufficientStock:
+                await session.rollback()
+                rejected += 1
+            except Exception:
+                await session.rollback()
+                errors += 1
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(checkout() for _ in range(args.checkouts)))
+    elapsed = perf_counter() - start
+
+    with Session(engine) as session:
+        remaining = session.get(Product, product_id).stock # type: ignore
+        held = session.exec(select(func.coalesce(func.sum(OrderItem.quantity), 0))).one()
+    await async_engine.dispose()
+    latencies.sort()
+    return {
+        'elapsed' : elapsed,
+        'sold' : sold,
+        'rejected' : rejected,
+        'errors' : errors,
+        'remaining' : remaining,
+        'held' : held,
+        'p50_ms' : latencies[len(latencies) // 2] * 1000,
+        'p99_ms' : latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+def main():
+    args = parse_args()
+    if args.database_url is None:
+        args.database_url = f'sqlite:///{tempfile.mkdtemp(prefix = "bench-")}/bench.db'
+    os.environ['DATABASE_URL'] = args.database_url
+
+    results = asyncio.run(run(args))
+    print(f"checkouts : {args.checkouts}, concurrency : {args.concurrency}, stock : {args.stock}, elapsed : {results['elapsed']:.2f}s")
+    print(f"checkouts/s : {args.checkouts / results['elapsed']:.1f}, p50 : {results['p50_ms']:.1f}ms, p99 : {results['p99_ms']:.1f}ms")
+    print(f"sold : {results['sold']}, rejected : {results['rejected']}, errors : {results['errors']}, remaining : {results['remaining']}")
+    # every unit is either still in stock or held by a committed order, and none went below zero
+    oversold = results['sold'] + results['remaining'] != args.stock or results['held'] != results['sold'] or results['remaining'] < 0
+    print('oversold : ' + ('YES' if oversold else 'no'))
+    if oversold:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+import httpx
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = 'Run load scenarios against the API and report per-route latency')
+    parser.add_argument('--database-url', default = None, help = 'Defaults to a fresh SQLite file in a temp directory')
+    parser.add_argument('--users', type = int, default = 1000)
+    parser.add_argument('--products', type = int, default = 10000)
+    parser.add_argument('--orders-per-user', type = float, default = 3.0)
+    parser.add_argument('--logins', type = int, default = 50, help = 'Number of users to log in for authenticated scenarios')
+    parser.add_argument('--duration', type = float, default = 30.0, help = 'Seconds to run the scenario mix')
+    parser.add_argument('--concurrency', type = int, default = 16)
+    parser.add_argument('--scenario', action = 'append', help = 'Run only these scenarios (repeatable)')
+    parser.add_argument('--paypal-latency', type = float, default = 0.05, help = 'Simulated PayPal latency in seconds')
+    parser.add_argument('--skip-seed', action = 'store_true', help = 'Reuse the data already in the database')
+    parser.add_argument('--reset', action = 'store_true', help = 'Drop and recreate all tables before seeding')
+    parser.add_argument('--seed', type = int, default = 42)
+    parser.add_argument('--output', default = None, help = 'Write the results as JSON to this path')
+    return parser.parse_args()
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def login(client : httpx.AsyncClient, user_ids):
+    from benchmarks.data import BENCH_PASSWORD
+    tokens = []
+    for user_id in user_ids:
+        response = await client.post('/auth/login', json = {'username' : f'user{user_id}', 'email' : f'user{user_id}@bench.test', 'password' : BENCH_PASSWORD})
+        response.raise_for_status()
+        tokens.append(response.json()['access_token'])
+    return tokens
+
+async def run_mix(ctx, scenarios : dict, duration : float, concurrency : int):
+    names = list(scenarios)
+    weights = [scenarios[name][1] for name in names]
+    counts = {name : 0 for name in names}
+    deadline = perf_counter() + duration
+
+    async def worker(seed : int):
+        rng = random.Random(seed)
+        while perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            await scenarios[name][0](ctx)
+            counts[name] += 1
+
+    start = perf_counter()
+    await asyncio.gather(*(worker(seed) for seed in range(concurrency)))
+    return perf_counter() - start, counts
+
+async def run(args):
+    from sqlmodel import SQLModel
+    from benchmarks.data import DatasetConfig, generate
+    from benchmarks.fake_paypal import FakePayPal
+    from benchmarks.scenarios import SCENARIOS, BenchContext, Recorder
+    from benchmarks.search import make_words
+    from db.database import create_db, engine
+    from main import app
+    from utils.metrics import paypal_event_hooks
+    from utils.paypal import PayPalClient
+    from utils.search import load_product_index
+
+    config = DatasetConfig(args.users, args.products, orders_per_user = args.orders_per_user, seed = args.seed)
+    scenarios = {name : SCENARIOS[name] for name in (args.scenario or SCENARIOS)}
+
+    async with app.router.lifespan_context(app):
+        counts = {}
+        if not args.skip_seed:
+            if args.reset:
+                SQLModel.metadata.drop_all(engine)
+                create_db()
+            start = perf_counter()
+            counts = generate(engine, config)
+            print(f'seeded {counts} in {perf_counter() - start:.1f}s')
+            load_product_index()
+
+        fake = FakePayPal(latency = args.paypal_latency, seed = args.seed)
+        await app.state.paypal.aclose()
+        app.state.paypal = PayPalClient(base_url = 'https://paypal.test', transport = fake.transport(), client_id = 'bench', secret = 'bench',
+                                        event_hooks = paypal_event_hooks())
+
+        async with httpx.AsyncClient(transport = httpx.ASGITransport(app = app), base_url = 'http://bench', timeout = 60) as client:
+            rng = random.Random(args.seed)
+            admin_tokens = await login(client, range(1, config.admins + 1))
+            tokens = await login(client, rng.sample(range(config.admins + 1, config.users + 1), min(args.logins, config.users - config.admins)))
+            recorder = Recorder()
+            ctx = BenchContext(client, recorder, tokens, admin_tokens, config.products, make_words(random.Random(args.seed), 2000), rng)
+            elapsed, scenario_counts = await run_mix(ctx, scenarios, args.duration, args.concurrency)
+
+    routes = recorder.report(elapsed)
+    return {
+        'commit' : git_commit(),
+        'timestamp' : datetime.now(timezone.utc).isoformat(),
+        'config' : vars(args),
+        'dataset' : counts,
+        'elapsed_s' : elapsed,
+        'requests' : sum(route['count'] for route in routes.values()),
+        'throughput_rps' : sum(route['count'] for route in routes.values()) / elapsed,
+        'scenarios' : scenario_counts,
+        'routes' : routes,
+    }
+
+def print_report(results : dict):
+    print(f"\n{results['requests']} requests in {results['elapsed_s']:.1f}s ({results['throughput_rps']:.1f} req/s)")
+    print(f"{'route':<32}{'count':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, route in results['routes'].items():
+        print(f"{label:<32}{route['count']:>8}{route['errors']:>6}{route['rps']:>9.1f}{route['p50_ms']:>10.2f}{route['p95_ms']:>10.2f}{route['p99_ms']:>10.2f}")
+
+def main():
+    args = parse_args()
+    if args.database_url is None:
+        args.database_url = f'sqlite:///{tempfile.mkdtemp(prefix = "bench-")}/bench.db'
+    os.environ['DATABASE_URL'] = args.database_url
+    # a fresh benchmark database is created from the models instead of migrated
+    os.environ.setdefault('DB_SCHEMA_MODE', 'create')
+    os.environ.setdefault('BCRYPT_ROUNDS', '4')
+    os.environ.setdefault('AUTH_SECRET_KEY', 'benchmark-secret-key-benchmark-secret')
+    # the load comes from one address and a handful of users, limiting it would measure the limiter
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent = 2)
+        print(f'\nresults written to {args.output}')
+
+if __name__ == '__main__':
+    main()
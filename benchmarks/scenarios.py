@@ -0,0 +1,108 @@
+import asyncio
+import random
+from collections import defaultdict
+from statistics import quantiles
+from time import perf_counter
+import httpx
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies : dict[str, list[float]] = defaultdict(list)
+        self.errors : dict[str, int] = defaultdict(int)
+
+    def record(self, label : str, seconds : float, ok : bool):
+        self.latencies[label].append(seconds * 1000)
+        if not ok:
+            self.errors[label] += 1
+
+    def report(self, elapsed : float):
+        routes = {}
+        for label, samples in sorted(self.latencies.items()):
+            cuts = quantiles(samples, n = 100) if len(samples) > 1 else samples * 99
+            routes[label] = {
+                'count' : len(samples),
+                'errors' : self.errors[label],
+                'rps' : len(samples) / elapsed,
+                'mean_ms' : sum(samples) / len(samples),
+                'p50_ms' : cuts[49],
+                'p95_ms' : cuts[94],
+                'p99_ms' : cuts[98],
+                'max_ms' : max(samples),
+            }
+        return routes
+
+
+class BenchContext:
+    def __init__(self, client : httpx.AsyncClient, recorder : Recorder, tokens : list[str], admin_tokens : list[str],
+                 products : int, words : list[str], rng : random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.tokens = tokens
+        self.admin_tokens = admin_tokens
+        self.products = products
+        self.words = words
+        self.rng = rng
+
+    async def request(self, label : str, method : str, url : str, token : str | None = None, **kwargs):
+        headers = {'Authorization' : f'Bearer {token}'} if token else {}
+        start = perf_counter()
+        response = await self.client.request(method, url, headers = headers, **kwargs)
+        self.recorder.record(label, perf_counter() - start, response.status_code < 400)
+        return response
+
+
+async def browse(ctx : BenchContext):
+    params = {'sort_by' : ctx.rng.choice(['name', 'price']), 'order' : ctx.rng.choice(['asc', 'desc']), 'limit' : 25}
+    response = await ctx.request('GET /products', 'GET', '/products/', params = params)
+    for _ in range(ctx.rng.randint(0, 4)):
+        cursor = response.headers.get('x-next-cursor')
+        if not cursor:
+            break
+        response = await ctx.request('GET /products (cursor)', 'GET', '/products/', params = {**params, 'cursor' : cursor})
+
+async def search(ctx : BenchContext):
+    word = ctx.rng.choice(ctx.words)
+    params = {'name' : word[:ctx.rng.randint(2, len(word))], 'limit' : 10}
+    if ctx.rng.random() < 0.3:
+        params['max_price'] = ctx.rng.randint(10, 200)
+    await ctx.request('GET /products?name', 'GET', '/products/', params = params)
+
+async def add_to_cart(ctx : BenchContext):
+    token = ctx.rng.choice(ctx.tokens)
+    items = [{'id' : ctx.rng.randint(1, ctx.products), 'quantity' : ctx.rng.randint(1, 3)} for _ in range(ctx.rng.randint(1, 5))]
+    await ctx.request('POST /cart/batch', 'POST', '/cart/batch', token, json = items)
+    await ctx.request('GET /cart', 'GET', '/cart/', token)
+
+async def checkout(ctx : BenchContext):
+    token = ctx.rng.choice(ctx.tokens)
+    await ctx.request('POST /cart', 'POST', '/cart/', token, json = {'id' : ctx.rng.randint(1, ctx.products), 'quantity' : 1})
+    response = await ctx.request('POST /order/create-order', 'POST', '/order/create-order', token)
+    if response.status_code >= 400:
+        return
+    paypal_order_id = response.json()['paypal_order_id']
+    await ctx.request('GET /order/capture-order', 'GET', '/order/capture-order', params = {'token' : paypal_order_id})
+    for _ in range(50):
+        status = await ctx.request('GET /order/capture-status', 'GET', f'/order/capture-status/{paypal_order_id}')
+        if status.status_code >= 400 or status.json()['order_status'] != 'processing':
+            break
+        await asyncio.sleep(0.05)
+    await ctx.request('GET /order', 'GET', '/order/', token)
+
+async def admin_listing(ctx : BenchContext):
+    token = ctx.rng.choice(ctx.admin_tokens)
+    params = {'sort_by' : ctx.rng.choice(['id', 'name', 'email']), 'limit' : 25}
+    response = await ctx.request('GET /user', 'GET', '/user/', token, params = params)
+    cursor = response.headers.get('x-next-cursor')
+    if cursor:
+        await ctx.request('GET /user (cursor)', 'GET', '/user/', token, params = {**params, 'cursor' : cursor})
+    await ctx.request('GET /order?include_items', 'GET', '/order/', token, params = {'include_items' : True})
+
+
+SCENARIOS = {
+    'browse' : (browse, 40),
+    'search' : (search, 25),
+    'add_to_cart' : (add_to_cart, 20),
+    'checkout' : (checkout, 5),
+    'admin_listing' : (admin_listing, 10),
+}
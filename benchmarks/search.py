@@ -0,0 +1,65 @@
+import argparse
+import random
+from decimal import Decimal
+from itertools import accumulate
+from statistics import quantiles
+from time import perf_counter
+from utils.search import ProductSearchIndex
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ran', 'te', 'vo', 'su', 'bel', 'dor', 'ni', 'pa', 'qui', 'zen', 'tor', 'ex', 'ul']
+
+
+def make_words(rng : random.Random, count : int):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def make_catalog(rng : random.Random, rows : int, words : list[str]):
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(words))))
+    for id in range(1, rows + 1):
+        name = ' '.join(rng.choices(words, cum_weights = cum_weights, k = 2))
+        description = ' '.join(rng.choices(words, cum_weights = cum_weights, k = 12))
+        yield id, name, description, Decimal(rng.randint(100, 100000)) / 100
+
+def make_queries(rng : random.Random, count : int, words : list[str]):
+    queries = []
+    for _ in range(count):
+        word = rng.choice(words)
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append((word[:rng.randint(2, len(word))], None, None))
+        elif kind < 0.8:
+            queries.append((f'{word} {rng.choice(words)[:3]}', None, None))
+        else:
+            low = Decimal(rng.randint(1, 500))
+            queries.append((word, low, low + 200))
+    return queries
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure product search latency on a synthetic catalog')
+    parser.add_argument('--rows', type = int, default = 1_000_000)
+    parser.add_argument('--vocabulary', type = int, default = 20_000)
+    parser.add_argument('--queries', type = int, default = 2_000)
+    parser.add_argument('--seed', type = int, default = 42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_words(rng, args.vocabulary)
+    index = ProductSearchIndex()
+
+    start = perf_counter()
+    index.build(make_catalog(rng, args.rows, words))
+    print(f'indexed {len(index)} products in {perf_counter() - start:.1f}s')
+
+    latencies = []
+    for query, min_price, max_price in make_queries(rng, args.queries, words):
+        start = perf_counter()
+        index.search(query, min_price, max_price)
+        latencies.append((perf_counter() - start) * 1000)
+
+    cuts = quantiles(latencies, n = 100)
+    print(f'queries : {len(latencies)}, p50 : {cuts[49]:.2f}ms, p95 : {cuts[94]:.2f}ms, p99 : {cuts[98]:.2f}ms, max : {max(latencies):.2f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from time import perf_counter
+from typing import List
+from pydantic import TypeAdapter
+from models.order import Order, OrderDetail, OrderItem, OrderRead, OrderStatus
+from models.products import Product, ProductRead
+from models.user import User, UserReadAdmin
+from utils.serialization import ORJSONResponse, orm_json
+
+
+def make_products(rows : int):
+    return [Product(id = id, name = f'Product {id}', description = f'Description of product {id} ' * 4, price = Decimal(id % 10000) / 100) for id in range(1, rows + 1)]
+
+def make_users(rows : int):
+    return [User(id = id, username = f'user{id}', email = f'user{id}@example.com', password = 'x' * 60, isadmin = id % 50 == 0) for id in range(1, rows + 1)]
+
+def make_orders(rows : int, products : list[Product]):
+    now = datetime.now(timezone.utc)
+    orders = []
+    for id in range(1, rows + 1):
+        order = Order(id = id, user_id = id % 100 + 1, created_at = now - timedelta(minutes = id), total_price = Decimal('99.90'), paypal_order_id = f'PAYPAL{id:010d}', status = OrderStatus.completed)
+        order.items = [OrderItem(id = id * 3 + n, order_id = id, product_id = product.id, quantity = n + 1, unit_price = product.price, product = product) for n, product in enumerate(products[id % 50:id % 50 + 3])]
+        orders.append(order)
+    return orders
+
+# what the endpoints did before: FastAPI validating the returned rows against response_model and
+# dumping them, after a model_dump() / model_validate() round trip per order in get_orders
+def response_model_json(adapter : TypeAdapter):
+    return lambda rows: adapter.dump_json(adapter.validate_python(rows, from_attributes = True))
+
+def order_round_trip_json(adapter : TypeAdapter):
+    return lambda rows: adapter.dump_json(adapter.validate_python([OrderDetail.model_validate(order.model_dump()) for order in rows], from_attributes = True))
+
+def orm_dump_json(adapter : TypeAdapter):
+    return lambda rows: orm_json(adapter, rows)
+
+def orjson_render(adapter : TypeAdapter):
+    response = ORJSONResponse.__new__(ORJSONResponse)
+    return lambda rows: response.render(adapter.dump_python(adapter.validate_python(rows, from_attributes = True)))
+
+def measure(serialize, rows, seconds : float):
+    serialize(rows)
+    count = 0
+    start = perf_counter()
+    while perf_counter() - start < seconds:
+        serialize(rows)
+        count += 1
+    return count * len(rows) / (perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare rows serialized per second for the list endpoints')
+    parser.add_argument('--rows', type = int, default = 100)
+    parser.add_argument('--seconds', type = float, default = 2.0)
+    args = parser.parse_args()
+
+    products = make_products(args.rows)
+    users = make_users(args.rows)
+    orders = make_orders(args.rows, products)
+
+    product_adapter = TypeAdapter(List[ProductRead])
+    user_adapter = TypeAdapter(List[UserReadAdmin])
+    order_adapter = TypeAdapter(List[OrderRead])
+    cases = [
+        ('products', products, response_model_json(product_adapter), product_adapter),
+        ('users', users, response_model_json(user_adapter), user_adapter),
+        ('orders', orders, order_round_trip_json(TypeAdapter(List[OrderDetail])), order_adapter),
+    ]
+    print(f'rows per page : {args.rows}')
+    for name, rows, before, adapter in cases:
+        before_rate = measure(before, rows, args.seconds)
+        after_rate = measure(orm_dump_json(adapter), rows, args.seconds)
+        orjson_rate = measure(orjson_render(adapter), rows, args.seconds)
+        print(f'{name:<9} before : {before_rate:>10,.0f} rows/s, orm dump_json : {after_rate:>10,.0f} rows/s ({after_rate / before_rate:.2f}x), orjson : {orjson_rate:>10,.0f} rows/s ({orjson_rate / before_rate:.2f}x)')
+
+if __name__ == '__main__':
+    main()
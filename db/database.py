@@ -1,16 +1,379 @@
+from collections import OrderedDict
+from functools import cache
+from itertools import count
+from threading import Lock
+from time import monotonic, perf_counter
+from fastapi import Request
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlmodel import create_engine, Session, SQLModel
-from dotenv import load_dotenv
-import os
+from sqlmodel.ext.asyncio.session import AsyncSession
+from utils.settings import settings
 
-load_dotenv()
+DATABASE_URL = settings.database_url
+ASYNC_DATABASE_URL = settings.async_database_url
+ALEMBIC_INI = settings.alembic_ini
+DB_SCHEMA_MODE = settings.db_schema_mode
 
-DATABASE_URL = os.getenv("DATABASE_URL", "mysql+pymysql://root:@127.0.0.1:3306/test")
+DB_ECHO = settings.db_echo
+DB_POOL_SIZE = settings.db_pool_size
+DB_MAX_OVERFLOW = settings.db_max_overflow
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+DB_POOL_RECYCLE = settings.db_pool_recycle
+DB_POOL_PRE_PING = settings.db_pool_pre_ping
 
-engine = create_engine(DATABASE_URL, echo = True)
+# comma separated, for SQLite replicas a read-only URI (sqlite:///file:replica.db?mode=ro&uri=true) keeps a
+# missing file from being created empty and lets it be reported as down instead
+DATABASE_REPLICA_URLS = settings.database_replica_urls
+DB_REPLICA_STRATEGY = settings.db_replica_strategy
+DB_REPLICA_RETRY_SECONDS = settings.db_replica_retry_seconds
+DB_READ_YOUR_WRITES_SECONDS = settings.db_read_your_writes_seconds
+DB_READ_YOUR_WRITES_MAX_KEYS = settings.db_read_your_writes_max_keys
+
+ASYNC_DRIVERS = {
+    'mysql' : 'mysql+aiomysql',
+    'mysql+pymysql' : 'mysql+aiomysql',
+    'mysql+mysqlconnector' : 'mysql+aiomysql',
+    'sqlite' : 'sqlite+aiosqlite',
+    'sqlite+pysqlite' : 'sqlite+aiosqlite',
+}
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.checked_out = 0
+        self.connects = 0
+        self.overflow_hits = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds : float):
+        self.wait_count += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self, pool):
+        return {
+            'pool_size' : pool.size() if hasattr(pool, 'size') else None,
+            'checked_out' : self.checked_out,
+            'overflow' : pool.overflow() if hasattr(pool, 'overflow') else None,
+            'checkouts' : self.checkouts,
+            'connects' : self.connects,
+            'overflow_hits' : self.overflow_hits,
+            'wait_avg_ms' : (self.wait_total / self.wait_count * 1000) if self.wait_count else 0.0,
+            'wait_max_ms' : self.wait_max * 1000,
+        }
+
+
+class InstrumentedQueuePool(QueuePool):
+    metrics : PoolMetrics
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_wait(perf_counter() - start)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    metrics : PoolMetrics
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_wait(perf_counter() - start)
+
+
+def to_async_url(url : str):
+    scheme, sep, rest = url.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+def pool_options(url : str, poolclass):
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass' : poolclass,
+        'pool_size' : DB_POOL_SIZE,
+        'max_overflow' : DB_MAX_OVERFLOW,
+        'pool_timeout' : DB_POOL_TIMEOUT,
+        'pool_recycle' : DB_POOL_RECYCLE,
+        'pool_pre_ping' : DB_POOL_PRE_PING,
+    }
+
+def instrument_pool(sync_engine):
+    metrics = PoolMetrics()
+    pool = sync_engine.pool
+    if isinstance(pool, (InstrumentedQueuePool, InstrumentedAsyncQueuePool)):
+        pool.metrics = metrics
+
+    @event.listens_for(sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        metrics.connects += 1
+        if hasattr(pool, 'overflow') and pool.overflow() > 0:
+            metrics.overflow_hits += 1
+
+    @event.listens_for(sync_engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+        metrics.checked_out += 1
+
+    @event.listens_for(sync_engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        metrics.checked_out -= 1
+
+    return metrics
+
+
+engine = create_engine(DATABASE_URL, echo = DB_ECHO, **pool_options(DATABASE_URL, InstrumentedQueuePool))
+async_engine = create_async_engine(ASYNC_DATABASE_URL or to_async_url(DATABASE_URL), echo = DB_ECHO,
+                                   **pool_options(DATABASE_URL, InstrumentedAsyncQueuePool))
+
+pool_metrics = {
+    'sync' : instrument_pool(engine),
+    'async' : instrument_pool(async_engine.sync_engine),
+}
+
+
+class Replica:
+    def __init__(self, name : str, url : str):
+        self.name = name
+        self.engine = create_engine(url, echo = DB_ECHO, **pool_options(url, InstrumentedQueuePool))
+        self.metrics = instrument_pool(self.engine)
+        self.down_until = 0.0
+        self.reads = 0
+        self.failures = 0
+
+    def stats(self):
+        return {
+            'up' : self.down_until <= monotonic(),
+            'reads' : self.reads,
+            'failures' : self.failures,
+            'in_use' : self.metrics.checked_out,
+        }
+
+
+class ReplicaSet:
+    def __init__(self, urls : list[str], strategy : str = DB_REPLICA_STRATEGY, retry_seconds : float = DB_REPLICA_RETRY_SECONDS):
+        if strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f'Unknown replica strategy : {strategy}')
+        self.replicas = [Replica(f'replica{i}', url) for i, url in enumerate(urls)]
+        self.strategy = strategy
+        self.retry_seconds = retry_seconds
+        self.fallbacks = 0
+        self._counter = count()
+
+    # a replica that failed is left out until its retry time, then the next read probes it again
+    def pick(self):
+        now = monotonic()
+        up = [replica for replica in self.replicas if replica.down_until <= now]
+        if not up:
+            return None
+        start = next(self._counter) % len(up)
+        if self.strategy == 'least_connections':
+            # rotating the start spreads ties instead of always landing on the first replica
+            return min(up[start:] + up[:start], key = lambda replica: replica.metrics.checked_out)
+        return up[start]
+
+    def mark_down(self, replica : Replica):
+        replica.failures += 1
+        replica.down_until = monotonic() + self.retry_seconds
+
+    def stats(self):
+        return {
+            'strategy' : self.strategy,
+            'fallbacks' : self.fallbacks,
+            'replicas' : {replica.name : replica.stats() for replica in self.replicas},
+        }
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+# clients that wrote recently, their reads stay on the primary until replication has caught up
+class RecentWriters:
+    def __init__(self, window : float = DB_READ_YOUR_WRITES_SECONDS, max_keys : int = DB_READ_YOUR_WRITES_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self.pinned = 0
+        self._until : OrderedDict[str, float] = OrderedDict()
+        self._lock = Lock()
+
+    def record(self, key : str):
+        if self.window <= 0:
+            return
+        with self._lock:
+            self._until[key] = monotonic() + self.window
+            self._until.move_to_end(key)
+            if len(self._until) > self.max_keys:
+                self._until.popitem(last = False)
+
+    def recent(self, key : str):
+        until = self._until.get(key)
+        if until is None:
+            return False
+        if until <= monotonic():
+            with self._lock:
+                self._until.pop(key, None)
+            return False
+        self.pinned += 1
+        return True
+
+    def stats(self):
+        return {
+            'window_s' : self.window,
+            'keys' : len(self._until),
+            'pinned' : self.pinned,
+        }
+
+
+replica_set = ReplicaSet(DATABASE_REPLICA_URLS)
+recent_writers = RecentWriters()
+
+def get_pool_metrics():
+    return {
+        'sync' : pool_metrics['sync'].snapshot(engine.pool),
+        'async' : pool_metrics['async'].snapshot(async_engine.sync_engine.pool),
+        **{replica.name : replica.metrics.snapshot(replica.engine.pool) for replica in replica_set.replicas},
+    }
+
+def get_replica_stats():
+    return {
+        **replica_set.stats(),
+        'read_your_writes' : recent_writers.stats(),
+    }
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def alembic_config():
+    from alembic.config import Config
+    return Config(ALEMBIC_INI, attributes = {'configure_logger' : False})
+
+def stamp_head():
+    from alembic import command
+    command.stamp(alembic_config(), 'head')
+
+def upgrade_schema():
+    from alembic import command
+    command.upgrade(alembic_config(), 'head')
 
 def create_db():
+    existing = set(inspect(engine).get_table_names())
     SQLModel.metadata.create_all(engine)
+    # a database built from scratch already has the latest schema, older ones go through alembic upgrade
+    if not existing & set(SQLModel.metadata.tables):
+        stamp_head()
 
-def get_session():
+# read from the migration scripts once per process, a preforked worker inherits it
+@cache
+def expected_revisions():
+    from alembic.script import ScriptDirectory
+    return frozenset(ScriptDirectory.from_config(alembic_config()).get_heads())
+
+def current_revisions():
+    with engine.connect() as connection:
+        try:
+            return frozenset(connection.execute(text('SELECT version_num FROM alembic_version')).scalars())
+        except DBAPIError:
+            return frozenset()
+
+# one query at boot instead of create_all's inspection of every table; migrating is a separate step
+def check_schema():
+    current, expected = current_revisions(), expected_revisions()
+    if current != expected:
+        raise SchemaOutOfDate(f"Database schema is at {', '.join(sorted(current)) or 'no revision'}, "
+                              f"the code expects {', '.join(sorted(expected))}; run alembic upgrade head")
+
+def prepare_schema(mode : str = DB_SCHEMA_MODE):
+    if mode == 'check':
+        check_schema()
+    elif mode == 'upgrade':
+        upgrade_schema()
+    elif mode == 'create':
+        create_db()
+    elif mode != 'off':
+        raise ValueError(f'Unknown schema mode : {mode}')
+
+# a forked worker must not reuse the parent's pooled connections; close = False leaves the
+# sockets to the parent instead of closing them under it
+def dispose_engines(close : bool = True):
+    engine.dispose(close = close)
+    async_engine.sync_engine.dispose(close = close)
+    for replica in replica_set.replicas:
+        replica.engine.dispose(close = close)
+
+def writer_key(request : Request):
+    # the token's user when there is one, so a user's other devices see their write too
+    from utils.auth_utils import decode_access_token
+    authorization = request.headers.get('authorization', '')
+    if authorization[:7].lower() == 'bearer ':
+        payload = decode_access_token(authorization[7:])
+        if payload and 'sub' in payload:
+            return f"user:{payload['sub']}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+# a session writes when it flushes ORM changes or executes an insert, update or delete, and
+# has written once such a transaction commits; GET handlers such as capture-order count too
+@event.listens_for(Session, 'after_flush')
+def flushed(session, flush_context):
+    session.info['writing'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def executed(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['writing'] = True
+
+@event.listens_for(Session, 'after_commit')
+def committed(session):
+    if session.info.pop('writing', False):
+        session.info['wrote'] = True
+
+@event.listens_for(Session, 'after_rollback')
+def rolled_back(session):
+    session.info.pop('writing', None)
+
+def record_write(request : Request, session : Session | AsyncSession):
+    if session.info.get('wrote') and replica_set.replicas:
+        recent_writers.record(writer_key(request))
+
+def get_session(request : Request):
     with Session(engine) as session:
         yield session
+    record_write(request, session)
+
+async def get_async_session(request : Request):
+    async with AsyncSession(async_engine, expire_on_commit = False) as session:
+        yield session
+    record_write(request, session)
+
+# for handlers that only read; the connection is taken up front so a replica that is down is
+# noticed here and the read goes to another replica or the primary instead of failing
+def get_read_session(request : Request):
+    session = None
+    if replica_set.replicas and not recent_writers.recent(writer_key(request)):
+        while session is None and (replica := replica_set.pick()) is not None:
+            session = Session(replica.engine)
+            try:
+                session.connection()
+                session.info['replica'] = replica.name
+                replica.reads += 1
+            except DBAPIError:
+                session.close()
+                session = None
+                replica_set.mark_down(replica)
+        if session is None:
+            replica_set.fallbacks += 1
+    with session or Session(engine) as read_session:
+        yield read_session
+
+def reads_from_replica(session : Session):
+    return 'replica' in session.info
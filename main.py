@@ -1,22 +1,75 @@
+# first, so the startup time of a worker that is not preforked includes importing the app
+from utils.startup import startup_timer
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
-from db.database import create_db
+from fastapi import Depends, FastAPI
+from db.database import async_engine, engine, prepare_schema, replica_set
 from routes.auth import auth_router
 from routes.products import products_router
 from routes.cart import cart_router
 from routes.orders import orders_router
 from routes.user import user_router
+from routes.system import metrics_router, system_router
+from utils.auth_utils import invalidate_users
+from utils.cache_sync import cache_sync
+from utils.capture_queue import capture_queue
+from utils.catalog_cache import catalog_cache
+from utils.email_filter import load_email_filter
+from utils.hashing import hashing_pool
+from utils import metrics, profiler
+from utils.metrics import MetricsMiddleware, paypal_event_hooks
+from utils.profiler import ProfilerMiddleware
+from utils.paypal import PayPalClient
+from utils.rate_limit import concurrency_limit, rate_limit
+from utils.reaper import REAPER_ENABLED, order_reaper
+from utils.search import load_product_index, refresh_products
+
+# every worker keeps these in memory, the sync task runs them when another worker wrote
+cache_sync.on('catalog', catalog_cache.refresh)
+cache_sync.on('catalog', refresh_products)
+cache_sync.on('users', invalidate_users)
 
 @asynccontextmanager
 async def lifespan(app : FastAPI):
-    create_db()
+    with startup_timer.phase('schema'):
+        prepare_schema()
+    hashing_pool.start()
+    cache_sync.prime()
+    with startup_timer.phase('search_index'):
+        load_product_index()
+    with startup_timer.phase('email_filter'):
+        load_email_filter()
+    app.state.paypal = PayPalClient(event_hooks = paypal_event_hooks())
+    capture_queue.start(lambda: app.state.paypal)
+    if REAPER_ENABLED:
+        order_reaper.start()
+    cache_sync.start()
+    startup_timer.ready()
     yield
+    await cache_sync.stop()
+    await order_reaper.stop()
+    await capture_queue.stop()
+    await app.state.paypal.aclose()
+    hashing_pool.shutdown()
+    await async_engine.dispose()
+    engine.dispose()
+    replica_set.dispose()
+
+for sync_engine in (engine, async_engine.sync_engine, *(replica.engine for replica in replica_set.replicas)):
+    metrics.instrument_engine(sync_engine)
+    profiler.instrument_engine(sync_engine)
+
+def limits(name : str):
+    return [Depends(rate_limit()), Depends(concurrency_limit(name))]
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 
-app.include_router(auth_router, prefix = '/auth')
-app.include_router(products_router, prefix = '/products')
-app.include_router(cart_router, prefix = '/cart')
-app.include_router(orders_router, prefix = '/order')
-app.include_router(user_router, prefix = '/user')
\ No newline at end of file
+app.include_router(auth_router, prefix = '/auth', dependencies = limits('auth'))
+app.include_router(products_router, prefix = '/products', dependencies = limits('products'))
+app.include_router(cart_router, prefix = '/cart', dependencies = limits('cart'))
+app.include_router(orders_router, prefix = '/order', dependencies = limits('order'))
+app.include_router(user_router, prefix = '/user', dependencies = limits('user'))
+app.include_router(system_router, prefix = '/system', dependencies = limits('system'))
+app.include_router(metrics_router, dependencies = limits('metrics'))
\ No newline at end of file
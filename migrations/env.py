@@ -0,0 +1,44 @@
+from logging.config import fileConfig
+from alembic import context
+from sqlmodel import SQLModel
+from db.database import DATABASE_URL, engine
+from models.cache import CacheChange, CacheVersion
+from models.cart import CartItem
+from models.order import CaptureJob, Order, OrderItem, OrderSummary
+from models.products import Product
+from models.user import User
+
+config = context.config
+# the app stamps fresh databases at startup and must keep its own logging setup
+if config.config_file_name is not None and config.attributes.get('configure_logger', True):
+    fileConfig(config.config_file_name)
+
+target_metadata = SQLModel.metadata
+
+
+def run_migrations_offline():
+    context.configure(
+        url = DATABASE_URL,
+        target_metadata = target_metadata,
+        literal_binds = True,
+        dialect_opts = {'paramstyle' : 'named'},
+        render_as_batch = DATABASE_URL.startswith('sqlite'),
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(
+            connection = connection,
+            target_metadata = target_metadata,
+            render_as_batch = connection.dialect.name == 'sqlite',
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
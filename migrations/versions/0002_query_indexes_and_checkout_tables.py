@@ -0,0 +1,109 @@
+"""query indexes and checkout tables
+
+Keyset pagination indexes on user and product, one cart row per product,
+the checkout fingerprint and approve link on order, the unit price snapshot
+on orderitem and the capture job table.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def create_capturejob():
+    op.create_table('capturejob',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('paypal_order_id', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(length=1024), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['order.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('paypal_order_id')
+    )
+    with op.batch_alter_table('capturejob', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_capturejob_next_attempt_at'), ['next_attempt_at'], unique=False)
+
+
+def merge_duplicate_cart_rows():
+    # before the unique constraint every add made a new row, fold them into the oldest one
+    bind = op.get_bind()
+    cartitem = sa.table('cartitem', sa.column('id'), sa.column('user_id'), sa.column('product_id'), sa.column('quantity'))
+    duplicates = bind.execute(
+        sa.select(sa.func.min(cartitem.c.id), cartitem.c.user_id, cartitem.c.product_id, sa.func.sum(cartitem.c.quantity))
+        .group_by(cartitem.c.user_id, cartitem.c.product_id)
+        .having(sa.func.count() > 1)
+    ).all()
+    for keep_id, user_id, product_id, quantity in duplicates:
+        bind.execute(sa.update(cartitem).where(cartitem.c.id == keep_id).values(quantity = quantity))
+        bind.execute(sa.delete(cartitem).where(cartitem.c.user_id == user_id, cartitem.c.product_id == product_id, cartitem.c.id != keep_id))
+
+
+def upgrade() -> None:
+    # create_db() creates missing tables at startup, so the job table may already exist
+    if not sa.inspect(op.get_bind()).has_table('capturejob'):
+        create_capturejob()
+
+    merge_duplicate_cart_rows()
+    with op.batch_alter_table('cartitem', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_cartitem_user_product', ['user_id', 'product_id'])
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cart_fingerprint', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=True))
+        batch_op.add_column(sa.Column('approve_url', sqlmodel.sql.sqltypes.AutoString(length=512), nullable=True))
+
+    with op.batch_alter_table('orderitem', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=True))
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_name_id', ['name', 'id'], unique=False)
+        batch_op.create_index('ix_product_price_id', ['price', 'id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_email_id', ['email', 'id'], unique=False)
+        batch_op.create_index('ix_user_isadmin_id', ['isadmin', 'id'], unique=False)
+        batch_op.create_index('ix_user_username_id', ['username', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_username_id')
+        batch_op.drop_index('ix_user_isadmin_id')
+        batch_op.drop_index('ix_user_email_id')
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_price_id')
+        batch_op.drop_index('ix_product_name_id')
+
+    with op.batch_alter_table('orderitem', schema=None) as batch_op:
+        batch_op.drop_column('unit_price')
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_column('approve_url')
+        batch_op.drop_column('cart_fingerprint')
+
+    with op.batch_alter_table('cartitem', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_cartitem_user_product', type_='unique')
+
+    with op.batch_alter_table('capturejob', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_capturejob_next_attempt_at'))
+
+    op.drop_table('capturejob')
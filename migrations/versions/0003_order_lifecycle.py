@@ -0,0 +1,42 @@
+"""order lifecycle
+
+Order.status becomes a fixed set of values with its own length, and orders
+get the (user_id, created_at) and (status, created_at) indexes used by the
+history listing and pending-order sweeps.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ORDER_STATUSES = ('pending', 'processing', 'completed', 'cancelled', 'failed')
+
+
+def upgrade() -> None:
+    order = sa.table('order', sa.column('status'))
+    op.execute(sa.update(order).where(order.c.status.not_in(ORDER_STATUSES)).values(status = 'failed'))
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.alter_column('status', existing_type=sqlmodel.sql.sqltypes.AutoString(), type_=sa.String(length=16), existing_nullable=False)
+        batch_op.create_index('ix_order_status_created_at', ['status', 'created_at'], unique=False)
+        batch_op.create_index('ix_order_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_user_id_created_at')
+        batch_op.drop_index('ix_order_status_created_at')
+        batch_op.alter_column('status', existing_type=sa.String(length=16), type_=sqlmodel.sql.sqltypes.AutoString(), existing_nullable=False)
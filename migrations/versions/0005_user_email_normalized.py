@@ -0,0 +1,68 @@
+"""user email normalized
+
+Lower-cased, trimmed copy of user.email with a unique index, used by login
+and registration. Existing rows are backfilled in id ranges; when several
+accounts share an address only the oldest keeps it and the others are left
+NULL and reported.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def backfill_email_normalized():
+    bind = op.get_bind()
+    user = sa.table('user', sa.column('id'), sa.column('email'), sa.column('email_normalized'))
+    last_id = bind.execute(sa.select(sa.func.max(user.c.id))).scalar() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        bind.execute(
+            sa.update(user)
+            .where(user.c.id > start, user.c.id <= start + BATCH_SIZE)
+            .values(email_normalized = sa.func.lower(sa.func.trim(user.c.email)))
+        )
+
+    duplicates = bind.execute(
+        sa.select(user.c.email_normalized, sa.func.min(user.c.id))
+        .where(user.c.email_normalized.is_not(None))
+        .group_by(user.c.email_normalized)
+        .having(sa.func.count() > 1)
+    ).all()
+    for email, keep_id in duplicates:
+        ids = bind.execute(sa.select(user.c.id).where(user.c.email_normalized == email, user.c.id != keep_id)).scalars().all()
+        logger.warning('email %r is shared by users %s, only user %s keeps it for login', email, [keep_id, *ids], keep_id)
+        bind.execute(sa.update(user).where(user.c.id.in_(ids)).values(email_normalized = None))
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('email_normalized', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=True))
+
+    backfill_email_normalized()
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_email_normalized', ['email_normalized'], unique=True)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_email_normalized')
+        batch_op.drop_column('email_normalized')
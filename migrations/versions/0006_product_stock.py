@@ -0,0 +1,34 @@
+"""product stock
+
+Units available per product, reserved by checkout and given back when an
+order is cancelled, expires or fails. Existing products start untracked
+(NULL) so they keep selling until stock is set for them.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock', sa.Integer(), nullable=True))
+        batch_op.create_check_constraint('ck_product_stock', 'stock >= 0')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_constraint('ck_product_stock', type_='check')
+        batch_op.drop_column('stock')
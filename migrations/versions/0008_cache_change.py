@@ -0,0 +1,34 @@
+"""cache change
+
+The ids each cache version changed, so the workers refresh those entries
+instead of rebuilding their product index and caches on every write.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, Sequence[str], None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('cachechange',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('version', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('name', 'version')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('cachechange')
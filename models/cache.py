@@ -0,0 +1,16 @@
+from sqlmodel import Field, SQLModel
+
+
+# one counter per group of per-process caches, bumped in the same transaction as the write
+# that makes them stale; every worker polls the table and refreshes what changed
+class CacheVersion(SQLModel, table = True):
+    name : str = Field(primary_key = True, max_length = 32)
+    version : int = 0
+
+
+# what each version changed: the product or user id, or none when too much changed to list,
+# so a worker refreshes those entries instead of everything; old rows are pruned by bump_version
+class CacheChange(SQLModel, table = True):
+    name : str = Field(primary_key = True, max_length = 32)
+    version : int = Field(primary_key = True, sa_column_kwargs = {'autoincrement' : False})
+    item_id : int | None = None
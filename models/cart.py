@@ -1,23 +1,34 @@
 from decimal import Decimal
-from pydantic import BaseModel
-from sqlalchemy import Column, Numeric
-from sqlmodel import Field, SQLModel
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import Column, Numeric, UniqueConstraint
+from sqlmodel import Field, Relationship, SQLModel
+from models.products import Product, ProductRead
 
 
 class CartItem(SQLModel, table = True):
+    __table_args__ = (
+        UniqueConstraint('user_id', 'product_id', name = 'uq_cartitem_user_product'),
+    )
+
     id : int | None = Field(default = None, primary_key = True)
     user_id : int = Field(foreign_key = 'user.id')
     product_id : int = Field(foreign_key = 'product.id')
     quantity : int = Field(default = 1)
     unit_price : Decimal = Field(sa_column = Column(Numeric(10,2)))
+    product : Product | None = Relationship()
 
 class CartItemCreate(BaseModel):
     id : int
-    quantity : int = 1
+    quantity : int = Field(1, ge = 1)
 
 class CartItemRead(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+
     id : int
     user_id : int
     product_id : int
     quantity : int
     unit_price : Decimal
+
+class CartItemDetail(CartItemRead):
+    product : ProductRead | None
@@ -6,12 +6,13 @@ class FilterParamsBase(BaseModel):
     offset : int = Field(0, ge = 0)
     limit : int = Field(10, ge = 1, le = 25)
     order : Literal['asc', 'desc'] = Field('asc', description = 'Order by (asc, desc)')
+    cursor : str | None = Field(None, description = 'Cursor from the X-Next-Cursor header (replaces offset)')
 
 class FilterParamsProduct(FilterParamsBase):
     name : str | None = Field(None, description = 'Name to filter by (case - insensitive)')
     min_price : Decimal | None = Field(None, ge = 0, description = 'Filter by minimum price')
     max_price : Decimal | None = Field(None, ge = 0, description = 'Filter by maximum price')
-    sort_by : Literal['username', 'price'] = Field('username', description = 'Sort by (name, price)')
+    sort_by : Literal['name', 'price'] = Field('name', description = 'Sort by (name, price)')
 
 class FilterParamsUser(FilterParamsBase):
     name : str | None = Field(None, description = 'Name to filter by (case - insensitive)')
@@ -1,19 +1,53 @@
-from datetime import datetime,timezone
+from datetime import date, datetime, timezone
 from decimal import Decimal
 from enum import Enum
-from typing import Literal
-from pydantic import BaseModel
-from sqlalchemy import Column, ForeignKey, Integer, Numeric
-from sqlmodel import Field, SQLModel
+from typing import List, Literal
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import Column, Enum as SAEnum, ForeignKey, Index, Integer, Numeric, UniqueConstraint
+from sqlmodel import Field, Relationship, SQLModel
+from models.products import Product, ProductRead
+
+
+class OrderStatus(str, Enum):
+    pending = 'pending'
+    processing = 'processing'
+    completed = 'completed'
+    cancelled = 'cancelled'
+    failed = 'failed'
+    expired = 'expired'
+
+ORDER_TRANSITIONS = {
+    OrderStatus.pending : {OrderStatus.processing, OrderStatus.cancelled, OrderStatus.failed, OrderStatus.expired},
+    OrderStatus.processing : {OrderStatus.completed, OrderStatus.failed},
+    OrderStatus.completed : set(),
+    OrderStatus.cancelled : set(),
+    OrderStatus.failed : set(),
+    OrderStatus.expired : set(),
+}
+
+FINAL_ORDER_STATUSES = {status for status, targets in ORDER_TRANSITIONS.items() if not targets}
+# the statuses an order may be in to move to each status, for conditional UPDATEs
+ORDER_TRANSITION_SOURCES = {status : {source for source, targets in ORDER_TRANSITIONS.items() if status in targets} for status in OrderStatus}
 
 
 class Order(SQLModel, table = True):
+    __table_args__ = (
+        Index('ix_order_user_id_created_at', 'user_id', 'created_at'),
+        Index('ix_order_status_created_at', 'status', 'created_at'),
+    )
+
     id : int | None = Field(default = None, primary_key = True)
     user_id : int = Field(foreign_key = 'user.id')
-    created_at : datetime = Field(default = datetime.now(timezone.utc))
+    created_at : datetime = Field(default_factory = lambda: datetime.now(timezone.utc))
     total_price : Decimal = Field(sa_column = Column(Numeric(10,2)))
     paypal_order_id : str | None = Field(default = None, index = True)
-    status : str = Field(default = 'pending')
+    status : OrderStatus = Field(default = OrderStatus.pending, sa_type = SAEnum(OrderStatus, native_enum = False, length = 16), nullable = False) # type: ignore
+    cart_fingerprint : str | None = Field(default = None, max_length = 64)
+    approve_url : str | None = Field(default = None, max_length = 512)
+    items : List['OrderItem'] = Relationship(back_populates = 'order')
+
+    def can_transition(self, status : OrderStatus):
+        return status in ORDER_TRANSITIONS[OrderStatus(self.status)]
 
 class OrderItem(SQLModel, table = True):
     id : int | None = Field(default = None, primary_key = True)
@@ -24,20 +58,68 @@ class OrderItem(SQLModel, table = True):
         ))
     product_id : int = Field(foreign_key = 'product.id')
     quantity : int = Field(default = 1)
+    unit_price : Decimal | None = Field(default = None, sa_column = Column(Numeric(10,2)))
+    order : Order | None = Relationship(back_populates = 'items')
+    product : Product | None = Relationship()
+
+class CaptureJob(SQLModel, table = True):
+    id : int | None = Field(default = None, primary_key = True)
+    order_id : int = Field(foreign_key = 'order.id')
+    paypal_order_id : str = Field(max_length = 64, unique = True)
+    status : str = Field(default = 'queued', max_length = 16)
+    attempts : int = Field(default = 0)
+    next_attempt_at : datetime = Field(default_factory = lambda: datetime.now(timezone.utc), index = True)
+    locked_until : datetime | None = Field(default = None)
+    last_error : str | None = Field(default = None, max_length = 1024)
+    created_at : datetime = Field(default_factory = lambda: datetime.now(timezone.utc))
+    updated_at : datetime = Field(default_factory = lambda: datetime.now(timezone.utc))
+
+class OrderSummary(SQLModel, table = True):
+    __table_args__ = (
+        UniqueConstraint('day', 'status', name = 'uq_ordersummary_day_status'),
+    )
+
+    id : int | None = Field(default = None, primary_key = True)
+    day : date
+    status : OrderStatus = Field(sa_type = SAEnum(OrderStatus, native_enum = False, length = 16), nullable = False) # type: ignore
+    order_count : int = Field(default = 0)
+    item_count : int = Field(default = 0)
+    total_price : Decimal = Field(default = Decimal(0), sa_column = Column(Numeric(14,2), nullable = False))
 
 class OrderCreate(BaseModel):
     pass
 
 class OrderItemRead(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+
     id : int
     order_id : int
     product_id : int
     quantity : int
+    unit_price : Decimal | None = None
 
 class OrderRead(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+
     id : int
     user_id : int
     created_at : datetime
     total_price : Decimal
     paypal_order_id : str | None
-    status : str
\ No newline at end of file
+    status : OrderStatus
+
+class OrderItemDetail(OrderItemRead):
+    product : ProductRead | None
+
+class OrderDetail(OrderRead):
+    items : List[OrderItemDetail] | None = None
+
+class CaptureJobRead(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+
+    order_id : int
+    paypal_order_id : str
+    status : str
+    attempts : int
+    next_attempt_at : datetime
+    last_error : str | None
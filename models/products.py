@@ -1,22 +1,36 @@
 from decimal import Decimal
-from pydantic import BaseModel
-from sqlalchemy import Column, Numeric
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import CheckConstraint, Column, Index, Numeric
 from sqlmodel import Field, SQLModel
 
 
 class Product(SQLModel, table = True):
+    __table_args__ = (
+        Index('ix_product_name_id', 'name', 'id'),
+        Index('ix_product_price_id', 'price', 'id'),
+        CheckConstraint('stock >= 0', name = 'ck_product_stock'),
+    )
+
     id : int | None = Field(None, primary_key = True)
     name : str = Field(max_length = 32)
     description : str = Field(max_length = 256)
     price : Decimal = Field(sa_column=Column(Numeric(8, 2)))
+    # units available to new orders, pending and processing orders already hold theirs; NULL is not tracked
+    stock : int | None = Field(default = None)
 
 class ProductCreate(BaseModel):
     name : str
     description : str
     price : Decimal
+    stock : int | None = Field(None, ge = 0)
 
 class ProductRead(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+
     id : int
     name : str
     description : str
-    price : Decimal
\ No newline at end of file
+    price : Decimal
+
+class ProductReadAdmin(ProductRead):
+    stock : int | None
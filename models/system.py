@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+
+
+class ProfilerSettings(BaseModel):
+    enabled : bool | None = None
+    sample_rate : float | None = Field(None, ge = 0, le = 1, description = 'Fraction of requests to profile')
+    slow_ms : float | None = Field(None, ge = 0, description = 'Profile every request slower than this (null turns it off)')
@@ -1,19 +1,34 @@
+from sqlalchemy import Index
 from sqlmodel import Field,SQLModel
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 class User(SQLModel, table = True):
+    __table_args__ = (
+        Index('ix_user_username_id', 'username', 'id'),
+        Index('ix_user_email_id', 'email', 'id'),
+        Index('ix_user_isadmin_id', 'isadmin', 'id'),
+        Index('ix_user_email_normalized', 'email_normalized', unique = True),
+    )
+
     id: int | None = Field(default = None, primary_key = True)
     username: str = Field(max_length = 32)
     email: str = Field(max_length = 64)
+    # lookups and the uniqueness check go through this column, see normalize_email
+    email_normalized: str | None = Field(default = None, max_length = 64)
     password: str = Field(max_length = 256)
     isadmin : bool = Field(default = False)
 
+def normalize_email(email : str):
+    return email.strip().lower()
+
 class UserCreate(BaseModel):
     username: str
     email: str
     password: str
 
 class UserRead(BaseModel):
+    model_config = ConfigDict(from_attributes = True)
+
     id: int
     username: str
     email: str
@@ -1,50 +1,83 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from db.database import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.database import get_async_session, get_session
 from models.tokens import Token
-from models.user import User, UserCreate, UserRead
-from utils.auth_utils import create_access_token, get_current_user, get_password_hash, verify_password
+from models.user import User, UserCreate, UserRead, normalize_email
+from utils.auth_utils import create_access_token, get_current_user, get_password_hash, invalidate_user
+from utils.cache_sync import bump_version
+from utils.email_filter import email_filter
+from utils.hashing import hash_password_async, verify_and_update_async
+from utils.rate_limit import RATE_LIMIT_AUTH_COST, rate_limit
 
 
 auth_router = APIRouter()
 
-@auth_router.post('/register', response_model = UserRead)
-def register(user : UserCreate, session :  Session = Depends(get_session)):
-    exists = session.exec(select(User).where(User.email == user.email)).first()
-    if exists:
-        raise HTTPException(400, 'Email already exists.')
-    hashed_pw = get_password_hash(user.password)
-    db_user = User(username = user.username, email = user.email, password = hashed_pw)
+@auth_router.post('/register', response_model = UserRead, dependencies = [Depends(rate_limit(RATE_LIMIT_AUTH_COST))])
+async def register(user : UserCreate, session : AsyncSession = Depends(get_async_session)):
+    email = normalize_email(user.email)
+    # only a possible hit is worth a query, it saves hashing a password for a taken address
+    if email_filter.might_exist(email):
+        exists = (await session.exec(select(User.id).where(User.email_normalized == email))).first()
+        if exists:
+            raise HTTPException(400, 'Email already exists.')
+        email_filter.record_false_positive()
+    hashed_pw = await hash_password_async(user.password)
+    db_user = User(username = user.username, email = user.email, email_normalized = email, password = hashed_pw)
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(400, 'Email already exists.')
+    email_filter.add(email)
+    await session.refresh(db_user)
     return db_user
 
-@auth_router.post('/login', response_model = Token)
-def login(user : UserCreate, session : Session = Depends(get_session)):
-    db_user = session.exec(select(User).where(User.email == user.email)).first()
-    if not db_user or not verify_password(user.password, db_user.password):
+@auth_router.post('/login', response_model = Token, dependencies = [Depends(rate_limit(RATE_LIMIT_AUTH_COST))])
+async def login(user : UserCreate, session : AsyncSession = Depends(get_async_session)):
+    db_user = (await session.exec(select(User).where(User.email_normalized == normalize_email(user.email)))).first()
+    if not db_user:
         raise HTTPException(400, 'Invalid credentials')
+    valid, new_hash = await verify_and_update_async(user.password, db_user.password)
+    if not valid:
+        raise HTTPException(400, 'Invalid credentials')
+    if new_hash:
+        db_user.password = new_hash
+        await session.commit()
     token = create_access_token({
         'sub' : str(db_user.id)
     })
     return {
         'access_token' : token,
         'token_type' : 'bearer',
-        'user' : UserRead.model_validate(db_user.model_dump())
+        'user' : UserRead.model_validate(db_user)
     }
 
 @auth_router.put('/', response_model = dict)
 def update(username : str | None = None, email : str | None = None, password : str | None = None, user : User = Depends(get_current_user), session : Session = Depends(get_session)):
     if not user:
         raise HTTPException(400, 'Invalid credentials')
+    db_user = session.get(User, user.id)
+    if not db_user:
+        raise HTTPException(400, 'Invalid credentials')
     if username:
-        user.username = username
+        db_user.username = username
     if email:
-        user.email = email
+        db_user.email = email
+        db_user.email_normalized = normalize_email(email)
     if password:
-        user.password = get_password_hash(password)
-    session.commit()
+        db_user.password = get_password_hash(password)
+    bump_version(session, 'users', db_user.id)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(400, 'Email already exists.')
+    if email:
+        email_filter.add(db_user.email_normalized) # type: ignore
+    invalidate_user(db_user.id) # type: ignore
     return {
         'message' : 'Details updated successfully'
     }
@@ -53,8 +86,12 @@ def update(username : str | None = None, email : str | None = None, password : s
 def delete(user : User = Depends(get_current_user), session : Session = Depends(get_session)):
     if not user:
         raise HTTPException(400, 'Invalid credentials')
-    session.delete(user)
-    session.commit()
+    db_user = session.get(User, user.id)
+    if db_user:
+        session.delete(db_user)
+        bump_version(session, 'users', db_user.id)
+        session.commit()
+    invalidate_user(user.id) # type: ignore
     return {
         'message' : 'Profile has been successfully deleted'
     }
@@ -67,7 +104,9 @@ def admin_update(id : int, username : str, user : User = Depends(get_current_use
     if not user_:
         raise HTTPException(404, 'User not found')
     user_.username = username
+    bump_version(session, 'users', id)
     session.commit()
+    invalidate_user(id)
     return {
         'message' : "User's username has been changed successfully"
     }
@@ -81,7 +120,9 @@ def admin_delete(id : int, user : User = Depends(get_current_user), session : Se
     if not user_:
         raise HTTPException(404, 'User not found')
     session.delete(user_)
+    bump_version(session, 'users', id)
     session.commit()
+    invalidate_user(id)
     return {
         'message' : 'User has been deleted'
     }
\ No newline at end of file
@@ -1,35 +1,82 @@
+from decimal import Decimal
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
-from db.database import get_session
-from models.cart import CartItem, CartItemCreate, CartItemRead
+from db.database import get_read_session, get_session
+from models.cart import CartItem, CartItemCreate, CartItemDetail, CartItemRead
 from models.products import Product
 from models.user import User
 from utils.auth_utils import get_current_user
+from utils.serialization import orm_response
 
 
 cart_router = APIRouter()
+cart_detail_list_adapter = TypeAdapter(List[CartItemDetail])
 
-@cart_router.get('/', response_model = List[CartItemRead])
-def get_cart_items(session : Session = Depends(get_session), user : User = Depends(get_current_user)):
-    cart_items = session.exec(select(CartItem).where(CartItem.user_id == user.id)).all()
-    return cart_items
+def upsert_cart_items(session : Session, user_id : int, items : dict[int, tuple[int, Decimal]]):
+    table = CartItem.__table__ # type: ignore
+    values = [
+        {'user_id' : user_id, 'product_id' : product_id, 'quantity' : quantity, 'unit_price' : price}
+        for product_id, (quantity, price) in items.items()
+    ]
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql_insert(table).values(values)
+        stmt = stmt.on_duplicate_key_update(quantity = table.c.quantity + stmt.inserted.quantity)
+    else:
+        stmt = (postgresql_insert if dialect == 'postgresql' else sqlite_insert)(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements = ['user_id', 'product_id'],
+            set_ = {'quantity' : table.c.quantity + stmt.excluded.quantity}
+        )
+    session.execute(stmt)
+
+# advisory only, stock is reserved for real when the order is created
+def check_stock(session : Session, user_id : int, product_ids):
+    short = session.exec(
+        select(CartItem.product_id)
+        .join(Product, Product.id == CartItem.product_id) # type: ignore
+        .where(CartItem.user_id == user_id, CartItem.product_id.in_(product_ids), Product.stock != None, CartItem.quantity > Product.stock) # type: ignore
+    ).all()
+    if short:
+        session.rollback()
+        raise HTTPException(409, f'Not enough stock for products : {sorted(short)}')
+
+def get_prices(session : Session, product_ids):
+    prices = dict(session.exec(select(Product.id, Product.price).where(Product.id.in_(product_ids))).all()) # type: ignore
+    missing = set(product_ids) - prices.keys()
+    if missing:
+        raise HTTPException(404, f'Products not found : {sorted(missing)}')
+    return prices
+
+@cart_router.get('/', response_model = List[CartItemDetail])
+def get_cart_items(session : Session = Depends(get_read_session), user : User = Depends(get_current_user)):
+    cart_items = session.exec(select(CartItem).where(CartItem.user_id == user.id).options(selectinload(CartItem.product))).all() # type: ignore
+    return orm_response(cart_detail_list_adapter, cart_items)
 
 @cart_router.post('/', response_model = CartItemRead)
 def post_cart_item(cart_item : CartItemCreate, session : Session = Depends(get_session), user : User = Depends(get_current_user)):
-    cart_list = session.exec(select(CartItem).where(CartItem.user_id == user.id, CartItem.product_id == cart_item.id)).first()
-
-    if cart_list:
-        cart_list.quantity += cart_item.quantity
-        session.commit()
-        session.refresh(cart_list)
-        return cart_list
-    price = session.get(Product, cart_item.id).price #type: ignore
-    new_item = CartItem(user_id = user.id, product_id = cart_item.id, quantity = cart_item.quantity, unit_price = price) # type: ignore
-    session.add(new_item)
+    prices = get_prices(session, [cart_item.id])
+    upsert_cart_items(session, user.id, {cart_item.id : (cart_item.quantity, prices[cart_item.id])}) # type: ignore
+    check_stock(session, user.id, [cart_item.id]) # type: ignore
+    session.commit()
+    return session.exec(select(CartItem).where(CartItem.user_id == user.id, CartItem.product_id == cart_item.id)).one()
+
+@cart_router.post('/batch', response_model = List[CartItemRead])
+def post_cart_items(cart_items : List[CartItemCreate] = Body(min_length = 1, max_length = 100), session : Session = Depends(get_session), user : User = Depends(get_current_user)):
+    quantities : dict[int, int] = {}
+    for item in cart_items:
+        quantities[item.id] = quantities.get(item.id, 0) + item.quantity
+    prices = get_prices(session, list(quantities))
+    upsert_cart_items(session, user.id, {id : (quantity, prices[id]) for id, quantity in quantities.items()}) # type: ignore
+    check_stock(session, user.id, list(quantities)) # type: ignore
     session.commit()
-    session.refresh(new_item)
-    return new_item
+    return session.exec(select(CartItem).where(CartItem.user_id == user.id, CartItem.product_id.in_(quantities))).all() # type: ignore
 
 @cart_router.delete('/{itemid}', response_model = dict)
 def delete_cart_item(item_id : int, session : Session = Depends(get_session), user : User = Depends(get_current_user)):
@@ -1,194 +1,180 @@
-from decimal import Decimal
-from os import getenv
 from typing import List
-from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException
+from uuid import uuid4
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 import httpx
+from pydantic import TypeAdapter
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
-from db.database import get_session
-from models.cart import CartItem
-from models.order import Order, OrderItem, OrderRead
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.database import get_async_session, get_read_session
+from models.order import FINAL_ORDER_STATUSES, CaptureJob, CaptureJobRead, Order, OrderDetail, OrderItem, OrderItemDetail, OrderRead, OrderStatus
 from models.user import User
 from utils.auth_utils import get_current_user
+from utils.capture_queue import enqueue_capture
+from utils.checkout import build_payload, copy_cart_to_order, find_reusable_order, get_cart_summary
+from utils.export import ExportFormat, export_response
+from utils.inventory import InsufficientStock, close_order, reserve_stock
+from utils.paypal import PayPalClient, get_paypal
+from utils.rate_limit import RATE_LIMIT_CHECKOUT_COST, rate_limit
+from utils.serialization import orm_response
 
 orders_router = APIRouter()
-load_dotenv()
+order_list_adapter = TypeAdapter(List[OrderRead])
+order_detail_list_adapter = TypeAdapter(List[OrderDetail])
 
-PAYPAL_API_BASE_URL = "https://api-m.sandbox.paypal.com"
-ACCESS_TOKEN = getenv('PAYPAL_ACCESS_TOKEN')
 
+@orders_router.get('/', response_model = List[OrderDetail])
+def get_orders(include_items : bool = False, session : Session = Depends(get_read_session), user : User = Depends(get_current_user)):
+    query = select(Order).where(Order.user_id == user.id).order_by(Order.created_at.desc(), Order.id.desc()) # type: ignore
+    if include_items:
+        query = query.options(selectinload(Order.items).selectinload(OrderItem.product)) # type: ignore
+    orders = session.exec(query).all()
+    # without include_items the items relationship is never touched, so no lazy load per order
+    return orm_response(order_detail_list_adapter if include_items else order_list_adapter, orders)
 
-@orders_router.get('/', response_model = List[OrderRead])
-def get_orders(session : Session = Depends(get_session), user : User = Depends(get_current_user)):
-    orders = session.exec(select(Order).where(Order.user_id == user.id)).all()
-    return [OrderRead.model_validate(order.model_dump()) for order in orders]
-
-@orders_router.post('/create-order', response_model = dict)
-async def create_paypal_order(session : Session = Depends(get_session), user : User = Depends(get_current_user)):
+@orders_router.post('/create-order', response_model = dict, dependencies = [Depends(rate_limit(RATE_LIMIT_CHECKOUT_COST))])
+async def create_paypal_order(session : AsyncSession = Depends(get_async_session), user : User = Depends(get_current_user), paypal : PayPalClient = Depends(get_paypal)):
     if not user:
         raise HTTPException(404, 'Invalid credentials')
     
-    cart = session.exec(select(CartItem).where(CartItem.user_id == user.id)).all()
+    summary = await get_cart_summary(session, user.id) # type: ignore
 
-    if not cart:
+    if not summary:
         raise HTTPException(404, 'Cart is empty')
-    
-    total_price = Decimal(0)
-    purchase_units = []
-    for item in cart:
-        item_total = item.unit_price * item.quantity
-        total_price += item_total
-        purchase_units.append({
-            'amount' : {
-                'currency_code' : 'USD',
-                'value' : str(item_total),
-                'breakdown' : {
-                    'item_total' : {
-                        'currency_code' : "USD",
-                        'value' : str(item_total)
-                    }
-                }
-            },
-            'items' : [
-                {
-                    'name' : f'Product ID :  {item.product_id}',
-                    'quantity' : str(item.quantity),
-                    'unit_amount' : {
-                        'currency_code' : 'USD',
-                        'value' : str(item.unit_price)
-                    }
-                }
-            ],
-            'reference_id' : f'product_{item.product_id}_user_{user.id}',
-            'description' : f'Item :  {item.product_id}, Quantity :  {item.quantity}'
-        })
-    
-    paypal_order_payload = {
-        'intent' : 'CAPTURE',
-        'purchase_units' : purchase_units,
-        'application_context' : {
-            'return_url' : 'http://localhost:8000/order/capture-order',
-            'cancel_url' : 'http://localhost:8000/order/cancel-order',
-            'brand_name' : 'E Commerce',
-            'shipping_preference' : 'NO_SHIPPING'
+
+    reusable = await find_reusable_order(session, summary)
+    if reusable:
+        return {
+            'paypal_order_id' : reusable.paypal_order_id,
+            'approve_url' : reusable.approve_url
         }
-    }
 
-    headers = {
-        'Content-Type' : 'application/json',
-        'Authorization' : f'Bearer {ACCESS_TOKEN}'
-    }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(f'{PAYPAL_API_BASE_URL}/v2/checkout/orders', json = paypal_order_payload, headers = headers)
-            response.raise_for_status()
-            paypal_order_response = response.json()
-
-            approve_link = next((link['href'] for link in paypal_order_response['links'] if link['rel'] == 'approve'), None)
-
-            if approve_link:
-                pending_order = Order(user_id = user.id, total_price = total_price, paypal_order_id = paypal_order_response['id'], status = 'pending') #type: ignore
-                session.add(pending_order)
-                session.commit()
-                session.refresh(pending_order)
-
-                for item in cart:
-                    order_item = OrderItem(order_id = pending_order.id, product_id = item.product_id, quantity = item.quantity) #type: ignore
-                    session.add(order_item)
-                session.commit()
-                return {
-                    'paypal_order_id' : paypal_order_response['id'],
-                    'approve_url' : approve_link
-                }
-            else:
-                raise HTTPException(500, 'Failed to get paypal approve url')
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(e.response.status_code, f'Paypal API Error :  {e.response.text}')
-        except Exception as e:
-            raise HTTPException(500, f'An Error Occured {str(e)}')
-
-@orders_router.get('/capture-order')
-async def capture_paypal_order(token : str, session : Session = Depends(get_session)):
+    paypal_order_payload = build_payload(summary)
+    # ends the read transaction, so no pooled connection is held while PayPal answers; the
+    # order is written in a new one, which copy_cart_to_order checks against this summary
+    await session.commit()
+
+    try:
+        paypal_order_response = await paypal.create_order(paypal_order_payload, request_id = str(uuid4()))
+
+        approve_link = next((link['href'] for link in paypal_order_response['links'] if link['rel'] == 'approve'), None)
+
+        if approve_link:
+            pending_order = Order(user_id = user.id, total_price = summary.total, paypal_order_id = paypal_order_response['id'], status = OrderStatus.pending, #type: ignore
+                                  cart_fingerprint = summary.fingerprint, approve_url = approve_link)
+            session.add(pending_order)
+            await session.flush()
+
+            if await copy_cart_to_order(session, pending_order.id, user.id) != summary.total: # type: ignore
+                await session.rollback()
+                raise HTTPException(409, 'Cart changed during checkout, please try again')
+            try:
+                await reserve_stock(session, pending_order.id) # type: ignore
+            except InsufficientStock as e:
+                await session.rollback()
+                raise HTTPException(409, str(e))
+            await session.commit()
+            return {
+                'paypal_order_id' : paypal_order_response['id'],
+                'approve_url' : approve_link
+            }
+        else:
+            raise HTTPException(500, 'Failed to get paypal approve url')
+    except HTTPException:
+        raise
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(e.response.status_code, f'Paypal API Error :  {e.response.text}')
+    except Exception as e:
+        raise HTTPException(500, f'An Error Occured {str(e)}')
+
+@orders_router.get('/capture-order', response_model = dict, status_code = 202)
+async def capture_paypal_order(token : str, request : Request, response : Response, session : AsyncSession = Depends(get_async_session)):
     paypal_order_id = token
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {ACCESS_TOKEN}"
-    }
 
-    pending_order = session.exec(select(Order).where(Order.paypal_order_id == paypal_order_id)).first()
+    pending_order = (await session.exec(select(Order).where(Order.paypal_order_id == paypal_order_id))).first()
     if not pending_order:
         raise HTTPException(404, 'Pending order not found or already processed')
     
-    if pending_order.status in ['completed', 'cancelled', 'failed']:
+    if pending_order.status in FINAL_ORDER_STATUSES:
+        response.status_code = 200
         return {
-            'message' : f"Order {pending_order.id} is in status : {pending_order.status}"
+            'message' : f"Order {pending_order.id} is in status : {pending_order.status.value}"
         }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(f'{PAYPAL_API_BASE_URL}/v2/checkout/orders/{paypal_order_id}/capture', headers = headers)
-            response.raise_for_status()
-            response = response.json()
-
-            if response.get('status') == 'COMPLETED':
-                pending_order.status = 'completed'
-
-                user_id = pending_order.user_id
-                cart_item = session.exec(select(CartItem).where(CartItem.user_id == user_id)).all()
-                for item in cart_item:
-                    session.delete(item)
-                session.commit()
-                return {"message": "Payment successful and order placed!", "order_id": pending_order.id, "paypal_capture_details": response}
-            else:
-                pending_order.status = 'failed'
-                session.commit()
-                raise HTTPException(status_code=400, detail=f"PayPal payment not completed: {response.get('status')}")
-        except httpx.HTTPStatusError as e:
-            if pending_order:
-                pending_order.status = 'failed'
-                session.commit()
-            raise HTTPException(status_code=e.response.status_code, detail=f"PayPal API error during capture: {e.response.text}")
-        except Exception as e:
-            if pending_order:
-                pending_order.status = 'failed'
-                session.commit()
-            raise HTTPException(status_code=500, detail=f"An error occurred during payment capture: {str(e)}")
+    job = await enqueue_capture(session, pending_order)
+    if job is None:
+        await session.refresh(pending_order)
+        response.status_code = 200
+        return {
+            'message' : f"Order {pending_order.id} is in status : {pending_order.status.value}"
+        }
+    return {
+        'message' : 'Payment received, capture in progress',
+        'order_id' : job.order_id,
+        'status' : job.status,
+        'status_url' : str(request.url_for('get_capture_status', token = paypal_order_id))
+    }
+
+@orders_router.get('/capture-status/{token}', response_model = dict)
+async def get_capture_status(token : str, session : AsyncSession = Depends(get_async_session)):
+    order = (await session.exec(select(Order).where(Order.paypal_order_id == token))).first()
+    if not order:
+        raise HTTPException(404, 'Order not found')
+    job = (await session.exec(select(CaptureJob).where(CaptureJob.paypal_order_id == token))).first()
+    return {
+        'order_id' : order.id,
+        'order_status' : order.status,
+        'capture' : CaptureJobRead.model_validate(job) if job else None
+    }
 
 @orders_router.get('/cancel-order', response_model = dict)
-async def cancel_paypal_order(token : str, session : Session = Depends(get_session)):
+async def cancel_paypal_order(token : str, session : AsyncSession = Depends(get_async_session)):
     paypal_order_id = token
-    pending_order = session.exec(select(Order).where(Order.paypal_order_id == paypal_order_id)).first()
+    pending_order = (await session.exec(select(Order).where(Order.paypal_order_id == paypal_order_id))).first()
 
     if pending_order:
-        if pending_order.status == 'pending':
-            pending_order.status = 'cancelled'
-            session.commit()
+        if await close_order(session, pending_order, OrderStatus.cancelled):
+            await session.commit()
             return {
                 'message' : f"Order {pending_order.id} has been cancelled"
             }
         else:
             return {
-                'message' : f"Order {pending_order.id} is already {pending_order.status}"
+                'message' : f"Order {pending_order.id} is already {pending_order.status.value}"
             }
     else:
         raise HTTPException(404, 'Pending order not found')
 
+@orders_router.get('/export')
+def admin_export_orders(format : ExportFormat = 'ndjson', user_id : int | None = None, status : OrderStatus | None = None, user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    where = []
+    if user_id is not None:
+        where.append(Order.user_id == user_id)
+    if status is not None:
+        where.append(Order.status == status)
+    return export_response('orders', Order, OrderRead, format, tuple(where))
+
 @orders_router.get('/{id}', response_model = dict)
-def get_order_by_id(id : int, session : Session = Depends(get_session), user : User = Depends(get_current_user)):
-    order = session.exec(select(Order).where(Order.id == id, Order.user_id == user.id)).first()
-    items = session.exec(select(OrderItem).where(OrderItem.order_id == order.id)).all() # type: ignore
+def get_order_by_id(id : int, session : Session = Depends(get_read_session), user : User = Depends(get_current_user)):
+    order = session.exec(
+        select(Order).where(Order.id == id, Order.user_id == user.id)
+        .options(selectinload(Order.items).selectinload(OrderItem.product)) # type: ignore
+    ).first()
+    if not order:
+        raise HTTPException(404, 'Order not found')
     return {
-        'order' : order,
-        'items' : items
+        'order' : OrderRead.model_validate(order),
+        'items' : [OrderItemDetail.model_validate(item) for item in order.items]
     }
 
 @orders_router.get('/{id}', response_model = List[OrderRead])
-def admin_get_orders(id : int, session : Session = Depends(get_session), user : User = Depends(get_current_user)):
+def admin_get_orders(id : int, session : Session = Depends(get_read_session), user : User = Depends(get_current_user)):
     if not user.isadmin:
         raise HTTPException(400, 'No permission')
     user_ = session.get(User, id)
     if not user_:
         raise HTTPException(404, 'No such user found')
     orders = session.exec(select(Order).where(Order.user_id == user_.id)).all()
-    return [OrderRead.model_validate(order.model_dump) for order in orders]
+    return orm_response(order_list_adapter, orders)
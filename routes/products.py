@@ -1,21 +1,56 @@
 from decimal import Decimal
 from typing import Annotated, List
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import TypeAdapter
 from sqlalchemy import func
-from sqlmodel import Session, asc, desc, select
-from db.database import get_session
+from sqlmodel import Session, select
+from db.database import DB_READ_YOUR_WRITES_SECONDS, get_read_session, get_session, reads_from_replica
 from models.filter import FilterParamsProduct
-from models.products import Product, ProductCreate, ProductRead
+from models.products import Product, ProductCreate, ProductRead, ProductReadAdmin
 from models.user import User
 from utils.auth_utils import get_current_user
+from utils.cache_sync import bump_version
+from utils.catalog_cache import catalog_cache, etag_matches
+from utils.export import ExportFormat, export_response
+from utils.pagination import next_cursor, paginate
+from utils.rate_limit import RATE_LIMIT_SEARCH_COST, rate_limit
+from utils.search import product_index
+from utils.serialization import ORJSONResponse, orm_json
 
 
 products_router = APIRouter()
+product_list_adapter = TypeAdapter(List[ProductRead])
 
-@products_router.get('/', response_model = List[ProductRead])
-def get_products(filter_params : FilterParamsProduct = Depends(),
-                 session : Session = Depends(get_session)
+@products_router.get('/', response_model = List[ProductRead], dependencies = [Depends(rate_limit(RATE_LIMIT_SEARCH_COST, param = 'name'))])
+def get_products(request : Request,
+                 filter_params : FilterParamsProduct = Depends(),
+                 session : Session = Depends(get_read_session)
                  ):
+    params_key = catalog_cache.params_key(filter_params)
+    version = catalog_cache.version()
+    etag = catalog_cache.etag(version, params_key[:16])
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code = 304, headers = {'ETag' : etag})
+
+    page = catalog_cache.get_page(version, params_key)
+    if page is None:
+        products, cursor = query_products(filter_params, session)
+        page = {
+            'items' : orm_json(product_list_adapter, products).decode(),
+            'next_cursor' : cursor
+        }
+        if not reads_from_replica(session) or catalog_cache.settled(DB_READ_YOUR_WRITES_SECONDS):
+            catalog_cache.set_page(version, params_key, page)
+
+    headers = {'ETag' : etag, 'Cache-Control' : 'no-cache'}
+    if page['next_cursor']:
+        headers['X-Next-Cursor'] = page['next_cursor']
+    return Response(content = page['items'], media_type = 'application/json', headers = headers)
+
+def query_products(filter_params : FilterParamsProduct, session : Session):
+    if filter_params.name and product_index.ready:
+        return search_products(filter_params, session), None
+
     query = select(Product)
     if filter_params.name:
         query = query.where(func.lower(Product.name).like(f'%{filter_params.name}%'))
@@ -25,19 +60,46 @@ def get_products(filter_params : FilterParamsProduct = Depends(),
         query = query.where(Product.price <= filter_params.max_price)
     
     to_sort = getattr(Product, filter_params.sort_by)
-    order_values = {
-        'asc' : asc,
-        'desc' : desc
-    }
-    to_order = order_values.get(filter_params.order, asc)
-    query = query.order_by(to_order(to_sort))
+    query = paginate(query, to_sort, Product.id, filter_params, Decimal if filter_params.sort_by == 'price' else None)
+
+    products = session.exec(query).all()
+    return products, next_cursor(products, filter_params.sort_by, filter_params)
+
+def search_products(filter_params : FilterParamsProduct, session : Session):
+    if filter_params.cursor:
+        raise HTTPException(400, 'Cursor pagination is not supported with name search')
+    ids = product_index.search(filter_params.name, filter_params.min_price, filter_params.max_price) # type: ignore
+    page = ids[filter_params.offset:filter_params.offset + filter_params.limit]
+    if not page:
+        return []
+    products = {product.id : product for product in session.exec(select(Product).where(Product.id.in_(page))).all()} # type: ignore
+    return [products[id] for id in page if id in products]
+
+@products_router.get('/export')
+def admin_export_products(format : ExportFormat = 'ndjson', user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return export_response('products', Product, ProductReadAdmin, format)
 
-    query = query.offset(filter_params.offset).limit(filter_params.limit)
+@products_router.get('/{id}', response_model = ProductRead)
+def get_product(id : int, request : Request, session : Session = Depends(get_read_session)):
+    version = catalog_cache.product_version(id)
+    etag = catalog_cache.etag(id, version)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code = 304, headers = {'ETag' : etag})
 
-    return session.exec(query).all()
+    product = catalog_cache.get_product(id, version)
+    if product is None:
+        db_product = session.get(Product, id)
+        if not db_product:
+            raise HTTPException(404, 'No product with id found')
+        product = ProductRead.model_validate(db_product).model_dump(mode = 'json')
+        if not reads_from_replica(session) or catalog_cache.settled(DB_READ_YOUR_WRITES_SECONDS):
+            catalog_cache.set_product(id, version, product)
+    return ORJSONResponse(product, headers = {'ETag' : etag, 'Cache-Control' : 'no-cache'})
 
 
-@products_router.post('/', response_model = ProductRead)
+@products_router.post('/', response_model = ProductReadAdmin)
 def admin_create_product(product : ProductCreate,
                          session : Session = Depends(get_session),
                          user : User = Depends(get_current_user)
@@ -46,12 +108,16 @@ def admin_create_product(product : ProductCreate,
         raise HTTPException(400, 'No permission')
     db_product = Product(**product.model_dump())
     session.add(db_product)
+    session.flush()
+    bump_version(session, 'catalog', db_product.id)
     session.commit()
     session.refresh(db_product)
+    product_index.add(db_product.id, db_product.name, db_product.description, db_product.price) # type: ignore
+    catalog_cache.bump(db_product.id)
     return db_product
 
-@products_router.put('/{id}', response_model = ProductRead)
-def admin_update_product(id : int, name : str | None = None, description : str | None = None, price : Decimal | None = None, session : Session = Depends(get_session), user : User = Depends(get_current_user)):
+@products_router.put('/{id}', response_model = ProductReadAdmin)
+def admin_update_product(id : int, name : str | None = None, description : str | None = None, price : Decimal | None = None, stock : int | None = Query(None, ge = 0), session : Session = Depends(get_session), user : User = Depends(get_current_user)):
     if not user.isadmin:
         raise HTTPException(400, 'No Permission')
     product = session.get(Product, id)
@@ -63,8 +129,13 @@ def admin_update_product(id : int, name : str | None = None, description : str |
         product.description = description
     if price:
         product.price = price
+    if stock is not None:
+        product.stock = stock
+    bump_version(session, 'catalog', id)
     session.commit()
     session.refresh(product)
+    product_index.add(product.id, product.name, product.description, product.price) # type: ignore
+    catalog_cache.bump(id)
     return product
 
 @products_router.delete('/{id}', response_model = dict)
@@ -75,7 +146,10 @@ def admin_delete_product(id : int, session : Session = Depends(get_session), use
     if not product:
         raise HTTPException(404, 'No product with id found')
     session.delete(product)
+    bump_version(session, 'catalog', id)
     session.commit()
+    product_index.remove(id)
+    catalog_cache.bump(id)
     return {
         'message' : 'Product successfully deleted'
     }
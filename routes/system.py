@@ -0,0 +1,115 @@
+from hmac import compare_digest
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import func
+from sqlmodel import Session, select
+from db.database import get_pool_metrics, get_replica_stats, get_session
+from models.order import CaptureJob
+from models.system import ProfilerSettings
+from models.user import User
+from utils.auth_utils import get_auth_cache_stats, get_current_user
+from utils.cache_sync import cache_sync
+from utils.capture_queue import capture_queue
+from utils.catalog_cache import catalog_cache
+from utils.email_filter import email_filter
+from utils.hashing import hashing_pool
+from utils.metrics import METRICS_TOKEN, render_metrics
+from utils.profiler import profiler
+from utils.rate_limit import get_rate_limit_stats
+from utils.reaper import order_reaper
+from utils.startup import startup_timer
+
+
+system_router = APIRouter()
+metrics_router = APIRouter()
+metrics_scheme = HTTPBearer(auto_error = False)
+
+@system_router.get('/pool', response_model = dict)
+def get_pool_stats(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return get_pool_metrics()
+
+@system_router.get('/startup', response_model = dict)
+def get_startup(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return startup_timer.stats()
+
+@system_router.get('/replicas', response_model = dict)
+def get_replicas(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return get_replica_stats()
+
+@system_router.get('/cache', response_model = dict)
+def get_cache_stats(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return {
+        'auth' : get_auth_cache_stats(),
+        'catalog' : catalog_cache.stats(),
+        'sync' : cache_sync.stats()
+    }
+
+@system_router.get('/hashing', response_model = dict)
+def get_hashing_stats(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return hashing_pool.stats()
+
+@system_router.get('/capture', response_model = dict)
+def get_capture_stats(session : Session = Depends(get_session), user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    jobs = dict(session.exec(select(CaptureJob.status, func.count()).group_by(CaptureJob.status)).all()) # type: ignore
+    return {**capture_queue.stats(), 'jobs' : jobs}
+
+@system_router.get('/reaper', response_model = dict)
+def get_reaper_stats(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return order_reaper.stats()
+
+@system_router.get('/profiler', response_model = dict)
+def get_profiler(user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    profiler.poll_settings()
+    return {**profiler.stats(), 'profiles' : profiler.list_profiles()}
+
+@system_router.put('/profiler', response_model = dict)
+def update_profiler(settings : ProfilerSettings, user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return profiler.update(settings.model_dump(exclude_unset = True))
+
+# a scraper sends METRICS_TOKEN as its bearer token; without one configured only admins can read them
+def metrics_access(credentials : HTTPAuthorizationCredentials | None = Depends(metrics_scheme), session : Session = Depends(get_session)):
+    if credentials is None:
+        raise HTTPException(401, 'Not authenticated')
+    if METRICS_TOKEN and compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        return
+    user = get_current_user(credentials, session)
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+
+@metrics_router.get('/metrics', response_class = PlainTextResponse, include_in_schema = False, dependencies = [Depends(metrics_access)])
+def get_metrics():
+    auth_cache = get_auth_cache_stats()
+    replicas = get_replica_stats()
+    return PlainTextResponse(render_metrics({
+        'app_db_pool' : ('engine', get_pool_metrics()),
+        'app_db_replica' : ('replica', replicas.pop('replicas')),
+        'app_db_replica_routing' : (None, replicas),
+        'app_cache' : ('cache', {**auth_cache, 'catalog' : catalog_cache.stats()}),
+        'app_hashing' : (None, hashing_pool.stats()),
+        'app_capture' : (None, capture_queue.stats()),
+        'app_reaper' : (None, order_reaper.stats()),
+        'app_cache_sync' : (None, cache_sync.stats()),
+        'app_profiler' : (None, profiler.stats()),
+        'app_email_filter' : (None, email_filter.stats()),
+        'app_rate_limit' : (None, get_rate_limit_stats()),
+        'app_startup' : (None, startup_timer.stats()),
+    }), media_type = 'text/plain; version=0.0.4')
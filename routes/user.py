@@ -1,18 +1,30 @@
 from typing import Annotated, List
 from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import TypeAdapter
 from sqlalchemy import func
-from sqlmodel import Session, asc, desc, select
-from db.database import get_session
+from sqlmodel import Session, select
+from db.database import get_read_session
 from models.filter import FilterParamsUser
 from models.user import User, UserReadAdmin
 from utils.auth_utils import get_current_user
+from utils.export import ExportFormat, export_response
+from utils.pagination import next_cursor, paginate
+from utils.serialization import orm_response
 
 
 user_router = APIRouter()
+user_list_adapter = TypeAdapter(List[UserReadAdmin])
+
+sort_columns = {
+    'id' : 'id',
+    'name' : 'username',
+    'email' : 'email',
+    'isadmin' : 'isadmin'
+}
 
 @user_router.get('/', response_model = List[UserReadAdmin])
 def get_users(filter_params : FilterParamsUser = Depends(),
-              session : Session = Depends(get_session),
+              session : Session = Depends(get_read_session),
               user : User = Depends(get_current_user),
               ):
     if not user.isadmin:
@@ -23,14 +35,15 @@ def get_users(filter_params : FilterParamsUser = Depends(),
     if filter_params.name:
         query = query.where(func.lower(User.username).like(f'%{filter_params.name}%'))
     
-    to_sort = getattr(User, filter_params.sort_by)
-    order_values = {
-        'asc' : asc,
-        'desc' : desc
-    }
-    to_order = order_values.get(filter_params.order, asc)
-    query = query.order_by(to_order(to_sort))
+    sort_attr = sort_columns[filter_params.sort_by]
+    query = paginate(query, getattr(User, sort_attr), User.id, filter_params)
 
-    query = query.offset(filter_params.offset).limit(filter_params.limit)
+    users = session.exec(query).all()
+    cursor = next_cursor(users, sort_attr, filter_params)
+    return orm_response(user_list_adapter, users, {'X-Next-Cursor' : cursor} if cursor else None)
 
-    return session.exec(query).all()
+@user_router.get('/export')
+def admin_export_users(format : ExportFormat = 'ndjson', user : User = Depends(get_current_user)):
+    if not user.isadmin:
+        raise HTTPException(400, 'No permission')
+    return export_response('users', User, UserReadAdmin, format)
@@ -0,0 +1,198 @@
+from time import perf_counter
+STARTED = perf_counter()
+
+import argparse
+import gc
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+from utils.settings import settings
+
+logger = logging.getLogger('serve')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description = 'Serve the API from preforked workers sharing one imported app')
+    parser.add_argument('--host', default = settings.serve_host)
+    parser.add_argument('--port', type = int, default = settings.serve_port)
+    parser.add_argument('--workers', type = int, default = settings.serve_workers)
+    parser.add_argument('--migrate', action = 'store_true', help = 'Run alembic upgrade head before starting the workers')
+    parser.add_argument('--budget-ms', type = float, default = settings.startup_budget_ms, help = 'Worker start time budget')
+    parser.add_argument('--check', action = 'store_true', help = 'Start the workers, report their start times and exit, non-zero when one is over budget')
+    parser.add_argument('--log-level', default = 'info')
+    return parser.parse_args()
+
+def bind(host : str, port : int):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+# work every worker would otherwise repeat on its own after the fork
+def preload(app, log_level : str):
+    from multiprocessing import resource_tracker
+    import httpcore # noqa: F401, httpx only imports its transport when the first client is made
+    import uvicorn
+    # imports the protocol and lifespan implementations the workers' servers will use
+    uvicorn.Config(app, log_level = log_level).load()
+    # the hashing pool's queues need the tracker process; started here it is shared by every
+    # worker instead of each one spawning and importing a fresh interpreter
+    resource_tracker.ensure_running()
+
+# runs in the forked child and never returns; the event loop, the hashing pool and the database
+# connections are all created here, only imported code and settings come from the parent
+def run_worker(app, sock : socket.socket, ready_fd : int, log_level : str):
+    import uvicorn
+    from db.database import dispose_engines
+    from utils.startup import startup_timer
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    startup_timer.restart()
+    dispose_engines(close = False)
+    startup_timer.on_ready = lambda stats: os.write(ready_fd, (json.dumps({'pid' : os.getpid(), **stats}) + '\n').encode())
+    code = 0
+    try:
+        config = uvicorn.Config(app, log_level = log_level, access_log = False, proxy_headers = True, forwarded_allow_ips = settings.forwarded_allow_ips)
+        uvicorn.Server(config).run(sockets = [sock])
+    except BaseException:
+        logger.exception('worker %d failed', os.getpid())
+        code = 1
+    os._exit(code)
+
+
+class Supervisor:
+    def __init__(self, app, sock : socket.socket, workers : int, budget_ms : float, log_level : str):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.budget_ms = budget_ms
+        self.log_level = log_level
+        self.stopping = False
+        self.children : dict[int, bool] = {}
+        self.reports : list[dict] = []
+        self._ready_read, self._ready_write = os.pipe()
+        self._buffer = b''
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            os.close(self._ready_read)
+            run_worker(self.app, self.sock, self._ready_write, self.log_level)
+        self.children[pid] = False
+        return pid
+
+    def stop(self, *args):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def read_reports(self, timeout : float):
+        readable, _, _ = select.select([self._ready_read], [], [], timeout)
+        if not readable:
+            return
+        self._buffer += os.read(self._ready_read, 65536)
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            report = json.loads(line)
+            self.children[report['pid']] = True
+            self.reports.append(report)
+            phases = ', '.join(f'{name} {ms:.0f}ms' for name, ms in report['phases_ms'].items())
+            over = report['total_ms'] > self.budget_ms
+            logger.log(logging.WARNING if over else logging.INFO, 'worker %d ready in %.0fms%s (%s)',
+                       report['pid'], report['total_ms'], f', over the {self.budget_ms:.0f}ms budget' if over else '', phases)
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            # the resource tracker is a child too and is left to multiprocessing
+            was_ready = self.children.pop(pid, None)
+            if was_ready is None or self.stopping:
+                continue
+            if not was_ready:
+                # a worker that dies before it is ready would die again, e.g. on an outdated schema
+                logger.error('worker %d exited with status %d before it was ready, stopping', pid, os.waitstatus_to_exitcode(status))
+                self.stop()
+                continue
+            logger.warning('worker %d exited with status %d, starting a new one', pid, os.waitstatus_to_exitcode(status))
+            self.spawn()
+
+    def run(self, check : bool = False):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            self.read_reports(0.5)
+            self.reap()
+            if check and not self.stopping and len(self.reports) >= self.workers:
+                self.stop()
+        return self.reports
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level = args.log_level.upper(), format = '%(asctime)s %(name)s %(levelname)s %(message)s')
+    if 'HASH_WORKERS' not in os.environ:
+        # every worker has its own bcrypt pool, together they should not outnumber the cores
+        settings.hash_workers = max(1, (os.cpu_count() or 1) // args.workers)
+        if 'HASH_QUEUE_LIMIT' not in os.environ:
+            settings.hash_queue_limit = settings.hash_workers * 4
+    settings.startup_budget_ms = args.budget_ms
+    # the schema is migrated here, once, never by the workers
+    settings.db_schema_mode = 'check'
+
+    start = perf_counter()
+    from main import app
+    from db.database import SchemaOutOfDate, check_schema, dispose_engines, upgrade_schema
+    preload(app, args.log_level)
+    imported_ms = (perf_counter() - start) * 1000
+    logger.info('imported the app in %.0fms (%.0fms since start)', imported_ms, (perf_counter() - STARTED) * 1000)
+
+    start = perf_counter()
+    if args.migrate:
+        upgrade_schema()
+    try:
+        check_schema()
+    except SchemaOutOfDate as e:
+        logger.error('%s', e)
+        sys.exit(1)
+    logger.info('schema %s in %.0fms', 'migrated and checked' if args.migrate else 'checked', (perf_counter() - start) * 1000)
+
+    sock = bind(args.host, args.port)
+    if settings.rate_limit_enabled and not settings.rate_limit_trust_forwarded and args.host in ('127.0.0.1', '::1', 'localhost'):
+        # only a local proxy can reach a loopback address, clients are told apart by what it forwards
+        logger.warning('listening on %s: the proxy in front must send X-Forwarded-For (trusted from %s), '
+                       'otherwise every anonymous client shares one rate limit bucket', args.host, settings.forwarded_allow_ips)
+    dispose_engines()
+    # everything imported so far is shared with the workers; frozen objects are left out of the
+    # collector so its passes do not write to, and unshare, the pages they live on
+    gc.collect()
+    gc.freeze()
+    logger.info('starting %d workers on %s:%d, budget %.0fms', args.workers, args.host, args.port, args.budget_ms)
+    reports = Supervisor(app, sock, args.workers, args.budget_ms, args.log_level).run(check = args.check)
+    sock.close()
+    if args.check:
+        times = sorted(report['total_ms'] for report in reports)
+        print(f'import : {imported_ms:.0f}ms, workers ready : {len(reports)}/{args.workers}, '
+              f'start max : {times[-1] if times else 0:.0f}ms, budget : {args.budget_ms:.0f}ms')
+        if len(reports) < args.workers or any(report['over_budget'] for report in reports):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,32 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from decimal import Decimal
-from sqlmodel import Session
-from db.database import create_db,engine
+from time import perf_counter
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlmodel import Session, select
+from db.database import engine, prepare_schema
 from models.cart import CartItem
-from models.products import Product
-from models.user import User
+from models.products import Product, ProductCreate
+from models.user import User, UserCreate, normalize_email
 from utils.auth_utils import get_password_hash
+from utils.cache_sync import bump_version
+from utils.hashing import hash_password
+
+IMPORTS = {
+    'products' : (ProductCreate, Product),
+    'users' : (UserCreate, User),
+}
 
 
 def seed():
     with Session(engine) as session:
-        user1 = User(username = 'a', email = 'a@gmail.com', password = get_password_hash('1234'), isadmin = True)
-        user2 = User(username = 'b', email = 'b@gmail.com', password = get_password_hash('9876'))
+        user1 = User(username = 'a', email = 'a@gmail.com', email_normalized = 'a@gmail.com', password = get_password_hash('1234'), isadmin = True)
+        user2 = User(username = 'b', email = 'b@gmail.com', email_normalized = 'b@gmail.com', password = get_password_hash('9876'))
         product1 = Product(name = 'Mango', description = 'A Mango', price = 20) # type: ignore
         product2 = Product(name = 'Banana', description = 'A Banana', price = 15)# type: ignore
         product3 = Product(name = 'Pencil', description = 'A Pencil', price = 1)# type: ignore
@@ -24,6 +40,118 @@ def seed():
         session.commit()
         print('Seeding complete')
 
+def read_rows(path : str):
+    with open(path, newline = '') as file:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+def read_chunks(rows, size : int):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def load_checkpoint(path : str):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as file:
+        return json.load(file)['rows']
+
+def save_checkpoint(path : str, rows : int):
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump({'rows' : rows}, file)
+    os.replace(f'{path}.tmp', path)
+
+def split_duplicate_emails(values : list[tuple[int, dict]]):
+    # one taken address would fail the whole chunk on the unique email_normalized index
+    for _, value in values:
+        value['email_normalized'] = normalize_email(value['email'])
+    with Session(engine) as session:
+        taken = set(session.exec(select(User.email_normalized).where(User.email_normalized.in_([value['email_normalized'] for _, value in values]))).all()) # type: ignore
+    unique, duplicates = [], []
+    for offset, value in values:
+        if value['email_normalized'] in taken:
+            duplicates.append((offset, value))
+        else:
+            taken.add(value['email_normalized'])
+            unique.append((offset, value))
+    return unique, duplicates
+
+def import_file(kind : str, path : str, chunk_size : int = 5000, workers : int | None = None, resume : bool = False):
+    schema, model = IMPORTS[kind]
+    table = model.__table__ # type: ignore
+    checkpoint = f'{path}.checkpoint'
+    done = load_checkpoint(checkpoint) if resume else 0
+    imported = rejected = 0
+    rows = read_rows(path)
+    for _ in range(done):
+        next(rows, None)
+
+    start = perf_counter()
+    with ProcessPoolExecutor(workers) if kind == 'users' else nullcontext() as pool, open(f'{path}.rejects.jsonl', 'a') as rejects:
+        for chunk in read_chunks(rows, chunk_size):
+            values = []
+            for offset, row in enumerate(chunk):
+                try:
+                    values.append((offset, schema.model_validate(row).model_dump()))
+                except ValidationError as e:
+                    rejected += 1
+                    rejects.write(json.dumps({'row' : done + offset + 1, 'data' : row, 'errors' : e.errors(include_url = False)}, default = str) + '\n')
+            if kind == 'users' and values:
+                values, duplicates = split_duplicate_emails(values)
+                for offset, _ in duplicates:
+                    rejected += 1
+                    rejects.write(json.dumps({'row' : done + offset + 1, 'data' : chunk[offset], 'errors' : [{'msg' : 'Email already exists'}]}, default = str) + '\n')
+            values = [value for _, value in values]
+            if kind == 'users' and values:
+                hashes = pool.map(hash_password, [value['password'] for value in values], chunksize = max(1, len(values) // (4 * (workers or os.cpu_count() or 1))))
+                for value, hashed in zip(values, hashes):
+                    value['password'] = hashed
+            if values:
+                with engine.begin() as connection:
+                    connection.execute(insert(table), values)
+            done += len(chunk)
+            imported += len(values)
+            save_checkpoint(checkpoint, done)
+            elapsed = perf_counter() - start
+            print(f'{kind} : {done} rows read, {imported} imported, {rejected} rejected, {imported / elapsed:.0f} rows/s')
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if not rejected and os.path.getsize(f'{path}.rejects.jsonl') == 0:
+        os.remove(f'{path}.rejects.jsonl')
+    return imported, rejected
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Seed demo data or bulk import products and users')
+    subparsers = parser.add_subparsers(dest = 'command')
+    importer = subparsers.add_parser('import', help = 'Stream a CSV or JSONL file into the database')
+    importer.add_argument('kind', choices = IMPORTS)
+    importer.add_argument('path')
+    importer.add_argument('--chunk-size', type = int, default = 5000)
+    importer.add_argument('--workers', type = int, default = None, help = 'Processes used to hash user passwords')
+    importer.add_argument('--resume', action = 'store_true', help = 'Continue from the last committed chunk')
+    args = parser.parse_args()
+
+    # DB_SCHEMA_MODE, like the app: checked by default, never created behind alembic's back
+    prepare_schema()
+    if args.command == 'import':
+        import_file(args.kind, args.path, args.chunk_size, args.workers, args.resume)
+    else:
+        seed()
+    if args.command != 'import' or args.kind == 'products':
+        # running workers rebuild their product index and drop their cached pages
+        with Session(engine) as session:
+            bump_version(session, 'catalog')
+            session.commit()
+
 if __name__ == '__main__':
-    create_db()
-    seed()
\ No newline at end of file
+    main()
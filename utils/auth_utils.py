@@ -1,22 +1,28 @@
 from datetime import timedelta, datetime, timezone
-from os import getenv
-from dotenv import load_dotenv
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer
 import jwt
-from passlib.context import CryptContext
 from sqlmodel import Session
 
 from db.database import get_session
 from models.user import User
+from utils.cache import TTLCache
+from utils.hashing import hash_password, pwd_context
+from utils.settings import settings
 
-load_dotenv()
-SECRET_KEY = getenv("AUTH_SECRET_KEY")
+SECRET_KEY = settings.auth_secret_key
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+USER_CACHE_SIZE = settings.user_cache_size
+USER_CACHE_TTL = settings.user_cache_ttl
+TOKEN_CACHE_SIZE = settings.token_cache_size
+TOKEN_CACHE_TTL = settings.token_cache_ttl
+
+CACHE_EXCLUDE = {'password', 'isadmin'}
 
-pwd_context = CryptContext(schemes = ['bcrypt'],deprecated = 'auto')
 oauth2_scheme = HTTPBearer()
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
 
 def create_access_token(data : dict, expire_delta : timedelta | None = None):
     to_encode = data.copy()
@@ -34,21 +40,53 @@ def verify_password(plain_pw : str, hashed_pw : str):
     return pwd_context.verify(plain_pw, hashed_pw)
 
 def get_password_hash(pw : str):
-    return pwd_context.hash(pw)
+    return hash_password(pw)
 
 def decode_access_token(token : str):
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, ALGORITHM)
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    remaining = payload['exp'] - datetime.now(timezone.utc).timestamp() if 'exp' in payload else TOKEN_CACHE_TTL
+    if remaining > 0:
+        token_cache.set(token, payload, min(remaining, TOKEN_CACHE_TTL))
+    return payload
+
+# bump_version(session, 'users', user_id) before the commit evicts it in the other workers
+def invalidate_user(user_id : int):
+    user_cache.pop(user_id)
+
+def invalidate_users(user_ids : list[int] | None = None):
+    if user_ids is None:
+        user_cache.clear()
+    for user_id in user_ids or []:
+        user_cache.pop(user_id)
+
+def get_auth_cache_stats():
+    return {
+        'users' : user_cache.stats(),
+        'tokens' : token_cache.stats()
+    }
 
 def get_current_user(credentials : HTTPAuthorizationCredentials = Depends(oauth2_scheme), session : Session = Depends(get_session)):
     token = credentials.credentials
     payload = decode_access_token(token)
     if not payload or 'sub' not in payload:
         raise HTTPException(401, 'Invalid or expired token')
-    user = session.get(User, int(payload['sub']))
+    user_id = int(payload['sub'])
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return User(**cached)
+    user = session.get(User, user_id)
+    if not user:
+        raise HTTPException(401, 'Invalid or expired token')
+    # admins always come from the database, so losing the flag takes effect on the next request;
+    # the cached read model has neither the flag nor the password hash
+    if not user.isadmin:
+        user_cache.set(user_id, user.model_dump(exclude = CACHE_EXCLUDE))
     return user
\ No newline at end of file
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class TTLCache:
+    def __init__(self, maxsize : int = 1024, ttl : float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data : OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl : float | None = None):
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def pop(self, key, default = None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'size' : len(self._data),
+            'maxsize' : self.maxsize,
+            'hits' : self.hits,
+            'misses' : self.misses,
+        }
+
+
+class MemoryCacheBackend:
+    shared = False
+
+    def __init__(self, maxsize : int = 4096, ttl : float = 300):
+        self._cache = TTLCache(maxsize, ttl)
+        self._counters : dict[str, int] = {}
+        self._lock = Lock()
+
+    def get(self, key : str) -> str | None:
+        if key in self._counters:
+            return str(self._counters[key])
+        return self._cache.get(key)
+
+    def set(self, key : str, value : str, ttl : float | None = None):
+        self._cache.set(key, value, ttl)
+
+    def delete(self, key : str):
+        self._cache.pop(key)
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def incr(self, key : str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class RedisCacheBackend:
+    shared = True
+
+    def __init__(self, client, ttl : float = 300):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key : str) -> str | None:
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    def set(self, key : str, value : str, ttl : float | None = None):
+        self.client.set(key, value, ex = max(1, int(self.ttl if ttl is None else ttl)))
+
+    def delete(self, key : str):
+        self.client.delete(key)
+
+    def incr(self, key : str) -> int:
+        return int(self.client.incr(key))
+
+    def stats(self):
+        return {
+            'backend' : 'redis'
+        }
+
+
+def create_cache_backend(kind : str, url : str | None = None, maxsize : int = 4096, ttl : float = 300):
+    if kind == 'memory':
+        return MemoryCacheBackend(maxsize, ttl)
+    if kind == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis cache backend requires the redis package')
+        return RedisCacheBackend(redis.Redis.from_url(url or 'redis://localhost:6379/0'), ttl)
+    raise ValueError(f'Unknown cache backend : {kind}')
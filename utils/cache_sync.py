@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Callable
+from sqlalchemy import delete, event, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.database import async_engine, engine
+from models.cache import CacheChange, CacheVersion
+from utils.settings import settings
+
+CACHE_SYNC_INTERVAL = settings.cache_sync_interval
+CACHE_SYNC_MAX_CHANGES = settings.cache_sync_max_changes
+CACHE_CHANGE_KEEP = settings.cache_change_keep
+PRUNE_EVERY = 100
+
+logger = logging.getLogger(__name__)
+
+
+# called before the commit of the write it belongs to, so the new version and the id it changed
+# are visible to the other workers exactly when the write is; no item_id means refresh everything
+def bump_version(session : Session, name : str, item_id : int | None = None):
+    table = CacheVersion.__table__ # type: ignore
+    changes = CacheChange.__table__ # type: ignore
+    result = session.execute(update(table).where(table.c.name == name).values(version = table.c.version + 1))
+    if result.rowcount == 0: # type: ignore
+        try:
+            with session.begin_nested():
+                session.execute(insert(table).values(name = name, version = 1))
+        except IntegrityError:
+            # another writer inserted the row first
+            session.execute(update(table).where(table.c.name == name).values(version = table.c.version + 1))
+    # the row stays locked until the commit, so this is the version this write made
+    version = session.execute(select(table.c.version).where(table.c.name == name)).scalar_one()
+    session.execute(insert(changes).values(name = name, version = version, item_id = item_id))
+    if version % PRUNE_EVERY == 0 and version > CACHE_CHANGE_KEEP:
+        session.execute(delete(changes).where(changes.c.name == name, changes.c.version <= version - CACHE_CHANGE_KEEP))
+    session.info.setdefault('cache_versions', []).append((name, version))
+
+# the writing process already updated its own caches, its sync skips the versions it committed
+@event.listens_for(Session, 'after_commit')
+def committed(session):
+    for name, version in session.info.pop('cache_versions', []):
+        cache_sync.skip(name, version)
+
+@event.listens_for(Session, 'after_rollback')
+def rolled_back(session):
+    session.info.pop('cache_versions', None)
+
+
+# the product index, the memory catalog cache and the user cache live in each worker; this polls
+# the versions bumped with every write and runs the refresh registered for each one that moved
+class CacheSync:
+    def __init__(self, interval : float, max_changes : int = CACHE_SYNC_MAX_CHANGES):
+        self.interval = interval
+        self.max_changes = max_changes
+        self.versions : dict[str, int] | None = None
+        self.runs = 0
+        self.refreshes : dict[str, int] = {}
+        self.reloads : dict[str, int] = {}
+        self.skipped = 0
+        self.errors = 0
+        self.last_run_at : datetime | None = None
+        self._handlers : dict[str, list[Callable[[list[int] | None], None]]] = {}
+        self._own : set[tuple[str, int]] = set()
+        self._own_lock = Lock()
+        self._task : asyncio.Task | None = None
+
+    # a handler gets the ids that changed, or None when it has to refresh everything
+    def on(self, name : str, handler : Callable[[list[int] | None], None]):
+        self._handlers.setdefault(name, []).append(handler)
+
+    def skip(self, name : str, version : int):
+        with self._own_lock:
+            self._own.add((name, version))
+
+    # read before the caches are first filled, so a write made while they load is seen on the first poll
+    def prime(self):
+        with Session(engine) as session:
+            self.versions = dict(session.exec(select(CacheVersion.name, CacheVersion.version)).all()) # type: ignore
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run(), name = 'cache-sync')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions = True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                self.errors += 1
+                logger.exception('Cache sync failed')
+
+    async def run_once(self):
+        changed : dict[str, list[int] | None] = {}
+        async with AsyncSession(async_engine) as session:
+            versions = dict((await session.exec(select(CacheVersion.name, CacheVersion.version))).all()) # type: ignore
+            previous = self.versions or {}
+            for name, version in versions.items():
+                seen = previous.get(name, 0)
+                if version <= seen:
+                    continue
+                with self._own_lock:
+                    own = {v for own_name, v in self._own if own_name == name and v <= version}
+                    self._own = {(own_name, v) for own_name, v in self._own if own_name != name or v > version}
+                self.skipped += len(own)
+                if version - seen - len(own) > self.max_changes:
+                    changed[name] = None
+                    continue
+                missing = [v for v in range(seen + 1, version + 1) if v not in own]
+                if not missing:
+                    continue
+                rows = (await session.exec(
+                    select(CacheChange.item_id).where(CacheChange.name == name, CacheChange.version.in_(missing)) # type: ignore
+                )).all()
+                ids = set(rows)
+                # pruned changes, or ones that did not name an id, need the full refresh
+                changed[name] = None if len(rows) < len(missing) or None in ids else sorted(ids) # type: ignore
+        self.versions = versions
+        for name, ids in changed.items():
+            for handler in self._handlers.get(name, []):
+                # a full index rebuild reads every product, keep it off the event loop
+                await asyncio.to_thread(handler, ids)
+            counter = self.reloads if ids is None else self.refreshes
+            counter[name] = counter.get(name, 0) + 1
+        self.runs += 1
+        self.last_run_at = datetime.now(timezone.utc)
+        return changed
+
+    def stats(self):
+        return {
+            'interval' : self.interval,
+            'versions' : dict(self.versions or {}),
+            'runs' : self.runs,
+            'refreshes' : dict(self.refreshes),
+            'reloads' : dict(self.reloads),
+            'skipped' : self.skipped,
+            'errors' : self.errors,
+            'last_run_at' : self.last_run_at.isoformat() if self.last_run_at else None,
+        }
+
+
+cache_sync = CacheSync(CACHE_SYNC_INTERVAL)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+import httpx
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.database import async_engine
+from models.order import CaptureJob, Order, OrderStatus
+from utils.checkout import clear_cart
+from utils.inventory import close_order
+from utils.paypal import PayPalClient
+from utils.settings import settings
+
+CAPTURE_WORKERS = settings.capture_workers
+CAPTURE_MAX_ATTEMPTS = settings.capture_max_attempts
+CAPTURE_BACKOFF = settings.capture_backoff
+CAPTURE_BACKOFF_MAX = settings.capture_backoff_max
+CAPTURE_LEASE_SECONDS = settings.capture_lease_seconds
+CAPTURE_POLL_INTERVAL = settings.capture_poll_interval
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+def claimable(now : datetime):
+    # queued jobs that are due, plus running jobs whose lease expired (worker crashed or hung)
+    return or_(
+        and_(CaptureJob.status == 'queued', CaptureJob.next_attempt_at <= now), # type: ignore
+        and_(CaptureJob.status == 'running', CaptureJob.locked_until < now) # type: ignore
+    )
+
+
+class CaptureQueue:
+    def __init__(self, workers : int, max_attempts : int, backoff : float, backoff_max : float, lease : float, poll_interval : float):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self._get_client : Callable[[], PayPalClient] | None = None
+        self._tasks : list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+
+    def start(self, get_client : Callable[[], PayPalClient]):
+        self._get_client = get_client
+        if not self._tasks:
+            self._wakeup = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._run(), name = f'capture-worker-{i}') for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions = True)
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.process_next():
+                    continue
+            except Exception:
+                logger.exception('Capture worker failed')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, session : AsyncSession):
+        now = utcnow()
+        job_id = (await session.exec(
+            select(CaptureJob.id).where(claimable(now)).order_by(CaptureJob.next_attempt_at).limit(1) # type: ignore
+        )).first()
+        if job_id is None:
+            return None
+        result = await session.execute(
+            update(CaptureJob)
+            .where(CaptureJob.id == job_id, claimable(now)) # type: ignore
+            .values(status = 'running', attempts = CaptureJob.attempts + 1, locked_until = now + timedelta(seconds = self.lease), updated_at = now)
+        )
+        await session.commit()
+        if result.rowcount != 1: # type: ignore
+            return False
+        return await session.get(CaptureJob, job_id)
+
+    # returns False only when no job was due, so workers know when to sleep
+    async def process_next(self):
+        async with AsyncSession(async_engine, expire_on_commit = False) as session:
+            job = await self._claim(session)
+            if job is None:
+                return False
+            if job is False:
+                return True
+            self.processed += 1
+            await self._capture(session, job)
+            return True
+
+    async def _capture(self, session : AsyncSession, job : CaptureJob):
+        try:
+            response = await self._get_client().capture_order(job.paypal_order_id) # type: ignore
+        except httpx.HTTPStatusError as e:
+            if 'ORDER_ALREADY_CAPTURED' in e.response.text:
+                response = {'status' : 'COMPLETED'}
+            elif e.response.status_code < 500 and e.response.status_code != 429:
+                return await self._finish(session, job, 'failed', OrderStatus.failed, f'PayPal API error during capture: {e.response.text}')
+            else:
+                return await self._retry(session, job, f'PayPal API error during capture: {e.response.text}')
+        except Exception as e:
+            return await self._retry(session, job, f'An error occurred during payment capture: {e!r}')
+
+        if response.get('status') == 'COMPLETED':
+            await self._finish(session, job, 'succeeded', OrderStatus.completed)
+        else:
+            await self._finish(session, job, 'failed', OrderStatus.failed, f"PayPal payment not completed: {response.get('status')}")
+
+    async def _retry(self, session : AsyncSession, job : CaptureJob, error : str):
+        if job.attempts >= self.max_attempts:
+            return await self._finish(session, job, 'failed', OrderStatus.failed, error)
+        self.retried += 1
+        delay = min(self.backoff_max, self.backoff * 2 ** (job.attempts - 1)) * (1 + random.random() / 4)
+        await self._finish(session, job, 'queued', None, error, delay)
+
+    async def _finish(self, session : AsyncSession, job : CaptureJob, status : str, order_status : OrderStatus | None,
+                      error : str | None = None, delay : float = 0.0):
+        now = utcnow()
+        # only the worker holding the current attempt may record its outcome
+        result = await session.execute(
+            update(CaptureJob)
+            .where(CaptureJob.id == job.id, CaptureJob.attempts == job.attempts) # type: ignore
+            .values(status = status, locked_until = None, last_error = error[:1024] if error else None,
+                    next_attempt_at = now + timedelta(seconds = delay), updated_at = now)
+        )
+        if result.rowcount != 1: # type: ignore
+            await session.rollback()
+            return
+        if order_status:
+            order = await session.get(Order, job.order_id)
+            # completing keeps the stock the order reserved, failing gives it back
+            if order and await close_order(session, order, order_status):
+                if order_status == OrderStatus.completed:
+                    await clear_cart(session, order.user_id)
+        await session.commit()
+        if status == 'succeeded':
+            self.succeeded += 1
+        elif status == 'failed':
+            self.failed += 1
+
+    def stats(self):
+        return {
+            'workers' : len(self._tasks),
+            'processed' : self.processed,
+            'succeeded' : self.succeeded,
+            'failed' : self.failed,
+            'retried' : self.retried,
+        }
+
+
+capture_queue = CaptureQueue(CAPTURE_WORKERS, CAPTURE_MAX_ATTEMPTS, CAPTURE_BACKOFF, CAPTURE_BACKOFF_MAX, CAPTURE_LEASE_SECONDS, CAPTURE_POLL_INTERVAL)
+
+# paypal_order_id is unique on the job table, so a repeated redirect gets the existing job back;
+# None when the order is no longer pending and nothing was queued
+async def enqueue_capture(session : AsyncSession, order : Order):
+    query = select(CaptureJob).where(CaptureJob.paypal_order_id == order.paypal_order_id)
+    job = (await session.exec(query)).first()
+    if job:
+        return job
+    # only from pending: the reaper or a cancel may have released the order's stock since it was read
+    if not await close_order(session, order, OrderStatus.processing):
+        await session.rollback()
+        return None
+    job = CaptureJob(order_id = order.id, paypal_order_id = order.paypal_order_id) # type: ignore
+    session.add(job)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        return (await session.exec(query)).one()
+    capture_queue.notify()
+    return job
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import secrets
+from time import time
+from pydantic import BaseModel
+from utils.cache import create_cache_backend
+from utils.settings import settings
+
+CATALOG_CACHE_BACKEND = settings.catalog_cache_backend
+CATALOG_CACHE_SIZE = settings.catalog_cache_size
+CATALOG_CACHE_TTL = settings.catalog_cache_ttl
+REDIS_URL = settings.redis_url
+
+VERSION_KEY = 'catalog:version'
+BUMPED_AT_KEY = 'catalog:bumped_at'
+
+
+class CatalogCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.scope : str | None = None
+        self.new_scope()
+        if not backend.shared:
+            os.register_at_fork(after_in_child = self.new_scope)
+
+    # a memory backend's versions are counted per process, two workers can reach the same number
+    # after different writes; its tags carry a per-process id so only the process that issued one
+    # ever answers 304 to it
+    def new_scope(self):
+        self.scope = None if self.backend.shared else secrets.token_hex(4)
+
+    def version(self) -> int:
+        return int(self.backend.get(VERSION_KEY) or 0)
+
+    # includes the catalog version, which is all another worker's write moves in a memory backend
+    def product_version(self, id : int) -> str:
+        return f"{self.version()}.{int(self.backend.get(f'catalog:product:{id}:version') or 0)}"
+
+    def bump(self, product_id : int | None = None):
+        self.backend.incr(VERSION_KEY)
+        if product_id is not None:
+            self.backend.incr(f'catalog:product:{product_id}:version')
+        self.backend.set(BUMPED_AT_KEY, str(time()))
+
+    # another worker changed the catalog; a shared backend already holds its bump, a memory one
+    # still has the pages and products it cached before the write
+    def refresh(self, product_ids : list[int] | None = None):
+        if self.backend.shared:
+            return
+        if product_ids is None:
+            self.bump()
+        for product_id in product_ids or []:
+            self.bump(product_id)
+
+    # whether the last write is older than a replica's expected lag, entries read from a
+    # replica before that may predate the write and must not be cached under the new version
+    def settled(self, seconds : float):
+        bumped_at = self.backend.get(BUMPED_AT_KEY)
+        return bumped_at is None or time() - float(bumped_at) >= seconds
+
+    def params_key(self, params : BaseModel):
+        raw = json.dumps(params.model_dump(mode = 'json'), sort_keys = True, separators = (',', ':'))
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def etag(self, *parts):
+        if self.scope:
+            parts = (self.scope, *parts)
+        return 'W/"' + '-'.join(str(part) for part in parts) + '"'
+
+    def _get(self, key : str):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def get_page(self, version : int, params_key : str):
+        return self._get(f'catalog:page:{version}:{params_key}')
+
+    def set_page(self, version : int, params_key : str, page : dict):
+        self.backend.set(f'catalog:page:{version}:{params_key}', json.dumps(page))
+
+    def get_product(self, id : int, version : str):
+        return self._get(f'catalog:product:{id}:{version}')
+
+    def set_product(self, id : int, version : str, product : dict):
+        self.backend.set(f'catalog:product:{id}:{version}', json.dumps(product))
+
+    def stats(self):
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'version' : self.version(),
+            'backend' : self.backend.stats()
+        }
+
+
+catalog_cache = CatalogCache(create_cache_backend(CATALOG_CACHE_BACKEND, REDIS_URL, CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL))
+
+def etag_matches(if_none_match : str | None, etag : str):
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, '*') for tag in if_none_match.split(','))
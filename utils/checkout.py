@@ -0,0 +1,138 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from sqlalchemy import delete, func, insert, literal
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.cart import CartItem
+from models.order import Order, OrderItem, OrderStatus
+from models.products import Product
+from utils.cache import TTLCache
+from utils.settings import settings
+
+CHECKOUT_REUSE_MINUTES = settings.checkout_reuse_minutes
+CHECKOUT_PAYLOAD_CACHE_SIZE = settings.checkout_payload_cache_size
+PAYPAL_RETURN_URL = settings.paypal_return_url
+PAYPAL_CANCEL_URL = settings.paypal_cancel_url
+
+CENTS = Decimal('0.01')
+
+payload_cache = TTLCache(CHECKOUT_PAYLOAD_CACHE_SIZE, CHECKOUT_REUSE_MINUTES * 60)
+
+
+class CartLine:
+    def __init__(self, product_id : int, name : str, quantity : int, unit_price : Decimal, line_total : Decimal):
+        self.product_id = product_id
+        self.name = name
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.line_total = line_total
+
+
+class CartSummary:
+    def __init__(self, user_id : int, lines : list[CartLine], total : Decimal):
+        self.user_id = user_id
+        self.lines = lines
+        self.total = total
+        self.fingerprint = hashlib.sha256(
+            ';'.join(f'{line.product_id}:{line.quantity}:{line.unit_price}' for line in lines).encode()
+        ).hexdigest()
+
+
+async def get_cart_summary(session : AsyncSession, user_id : int):
+    line_total = CartItem.unit_price * CartItem.quantity
+    rows = (await session.exec(
+        select(
+            CartItem.product_id,
+            Product.name,
+            CartItem.quantity,
+            CartItem.unit_price,
+            line_total.label('line_total'),
+            func.sum(line_total).over().label('grand_total')
+        )
+        .join(Product, Product.id == CartItem.product_id) # type: ignore
+        .where(CartItem.user_id == user_id)
+        .order_by(CartItem.product_id)
+    )).all()
+    if not rows:
+        return None
+    lines = [
+        CartLine(product_id, name, quantity, Decimal(unit_price).quantize(CENTS), Decimal(line).quantize(CENTS))
+        for product_id, name, quantity, unit_price, line, _ in rows
+    ]
+    return CartSummary(user_id, lines, Decimal(rows[0].grand_total).quantize(CENTS))
+
+def money(value : Decimal):
+    return {
+        'currency_code' : 'USD',
+        'value' : str(value)
+    }
+
+def build_payload(summary : CartSummary):
+    key = (summary.user_id, summary.fingerprint)
+    payload = payload_cache.get(key)
+    if payload is not None:
+        return payload
+    payload = {
+        'intent' : 'CAPTURE',
+        'purchase_units' : [
+            {
+                'reference_id' : f'user_{summary.user_id}_{summary.fingerprint[:16]}',
+                'description' : f'{len(summary.lines)} items',
+                'amount' : {
+                    **money(summary.total),
+                    'breakdown' : {
+                        'item_total' : money(summary.total)
+                    }
+                },
+                'items' : [
+                    {
+                        'name' : line.name[:127],
+                        'sku' : str(line.product_id),
+                        'quantity' : str(line.quantity),
+                        'unit_amount' : money(line.unit_price)
+                    }
+                    for line in summary.lines
+                ]
+            }
+        ],
+        'application_context' : {
+            'return_url' : PAYPAL_RETURN_URL,
+            'cancel_url' : PAYPAL_CANCEL_URL,
+            'brand_name' : 'E Commerce',
+            'shipping_preference' : 'NO_SHIPPING'
+        }
+    }
+    payload_cache.set(key, payload)
+    return payload
+
+async def find_reusable_order(session : AsyncSession, summary : CartSummary):
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes = CHECKOUT_REUSE_MINUTES)
+    return (await session.exec(
+        select(Order)
+        .where(
+            Order.user_id == summary.user_id,
+            Order.status == OrderStatus.pending,
+            Order.cart_fingerprint == summary.fingerprint,
+            Order.approve_url.is_not(None), # type: ignore
+            Order.created_at >= cutoff
+        )
+        .order_by(Order.id.desc()) # type: ignore
+    )).first()
+
+async def copy_cart_to_order(session : AsyncSession, order_id : int, user_id : int):
+    await session.execute(
+        insert(OrderItem).from_select(
+            ['order_id', 'product_id', 'quantity', 'unit_price'],
+            select(literal(order_id), CartItem.product_id, CartItem.quantity, CartItem.unit_price)
+            .where(CartItem.user_id == user_id)
+            .order_by(CartItem.product_id) # type: ignore
+        )
+    )
+    total = (await session.exec(
+        select(func.sum(OrderItem.unit_price * OrderItem.quantity)).where(OrderItem.order_id == order_id) # type: ignore
+    )).one()
+    return Decimal(total or 0).quantize(CENTS)
+
+async def clear_cart(session : AsyncSession, user_id : int):
+    await session.execute(delete(CartItem).where(CartItem.user_id == user_id)) # type: ignore
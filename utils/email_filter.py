@@ -0,0 +1,105 @@
+import hashlib
+from math import ceil, exp, log
+from threading import Lock
+from sqlmodel import Session, func, select
+from db.database import engine
+from models.user import User
+from utils.settings import settings
+
+EMAIL_FILTER_ENABLED = settings.email_filter_enabled
+EMAIL_FILTER_CAPACITY = settings.email_filter_capacity
+EMAIL_FILTER_ERROR_RATE = settings.email_filter_error_rate
+
+
+class BloomFilter:
+    def __init__(self, capacity : int, error_rate : float):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = ceil(-self.capacity * log(error_rate) / log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = Lock()
+
+    def _positions(self, key : str):
+        digest = hashlib.blake2b(key.encode(), digest_size = 16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key : str):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key : str):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_error_rate(self):
+        return (1 - exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+# answers "this email is definitely not registered" without a query; a maybe still goes to the
+# database and the unique index on email_normalized stays the source of truth, so a filter that
+# is stale (another worker registered the address) only costs the IntegrityError round trip
+class EmailFilter:
+    def __init__(self, capacity : int = EMAIL_FILTER_CAPACITY, error_rate : float = EMAIL_FILTER_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.ready = False
+        self.checks = 0
+        self.skipped = 0
+        self.false_positives = 0
+        self._filter = BloomFilter(capacity, error_rate)
+
+    def build(self, emails, count : int):
+        # sized for twice the current users so sign-ups keep the error rate near the target
+        bloom = BloomFilter(max(self.capacity, count * 2), self.error_rate)
+        for email in emails:
+            bloom.add(email)
+        self._filter = bloom
+        self.ready = True
+
+    def add(self, email : str):
+        self._filter.add(email)
+
+    def might_exist(self, email : str):
+        if not self.ready:
+            return True
+        self.checks += 1
+        if email in self._filter:
+            return True
+        self.skipped += 1
+        return False
+
+    def record_false_positive(self):
+        self.false_positives += 1
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            'ready' : self.ready,
+            'entries' : bloom.count,
+            'bits' : bloom.size,
+            'hashes' : bloom.hashes,
+            'estimated_error_rate' : bloom.estimated_error_rate(),
+            'checks' : self.checks,
+            'skipped' : self.skipped,
+            'false_positives' : self.false_positives,
+        }
+
+
+email_filter = EmailFilter()
+
+def load_email_filter(filter : EmailFilter = email_filter):
+    if not EMAIL_FILTER_ENABLED:
+        return
+    with Session(engine) as session:
+        count = session.exec(select(func.count()).select_from(User)).one()
+        rows = session.exec(
+            select(User.email_normalized).where(User.email_normalized != None).execution_options(yield_per = 10000) # type: ignore
+        )
+        filter.build(rows, count)
@@ -0,0 +1,58 @@
+import csv
+import io
+from datetime import datetime
+from enum import Enum
+from typing import Literal
+from fastapi.responses import StreamingResponse
+import orjson
+from pydantic import BaseModel
+from sqlmodel import Session, select
+from db.database import engine
+from utils.serialization import encode_default
+from utils.settings import settings
+
+EXPORT_BATCH_SIZE = settings.export_batch_size
+
+MEDIA_TYPES = {
+    'ndjson' : 'application/x-ndjson',
+    'csv' : 'text/csv; charset=utf-8',
+}
+
+ExportFormat = Literal['ndjson', 'csv']
+
+
+def csv_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def ndjson_chunk(names : list[str], rows):
+    return b''.join(orjson.dumps(dict(zip(names, row)), default = encode_default, option = orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+def csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+# only the columns of the Read model are selected, so rows come back as plain tuples without ORM
+# objects or pydantic models in between; the result is read from a server-side cursor one
+# batch at a time and each batch becomes one chunk of the response
+def export_rows(table, schema : type[BaseModel], format : ExportFormat, where : tuple = (), batch_size : int = EXPORT_BATCH_SIZE):
+    names = list(schema.model_fields)
+    query = select(*(getattr(table, name) for name in names)).where(*where).order_by(table.id)
+    if format == 'csv':
+        yield csv_chunk([names])
+    # the session belongs to the generator, the request's session is closed before streaming starts
+    with Session(engine) as session:
+        result = session.exec(query.execution_options(stream_results = True, yield_per = batch_size)) # type: ignore
+        for rows in result.partitions():
+            yield ndjson_chunk(names, rows) if format == 'ndjson' else csv_chunk(rows)
+
+def export_response(name : str, table, schema : type[BaseModel], format : ExportFormat, where : tuple = ()):
+    return StreamingResponse(
+        export_rows(table, schema, format, where),
+        media_type = MEDIA_TYPES[format],
+        headers = {'Content-Disposition' : f'attachment; filename="{name}.{format}"'}
+    )
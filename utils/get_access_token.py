@@ -1,11 +1,9 @@
 import os
 import requests
-from dotenv import load_dotenv
+from utils.settings import settings
 
-load_dotenv()
-
-CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
-CLIENT_SECRET = os.getenv("PAYPAL_SECRET_KEY")
+CLIENT_ID = settings.paypal_client_id
+CLIENT_SECRET = settings.paypal_secret_key
 OAUTH_URL = "https://api-m.sandbox.paypal.com/v1/oauth2/token"
 
 def get_new_paypal_token():
@@ -0,0 +1,65 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from utils.settings import settings
+
+BCRYPT_ROUNDS = settings.bcrypt_rounds
+HASH_WORKERS = settings.hash_workers
+HASH_QUEUE_LIMIT = settings.hash_queue_limit
+
+pwd_context = CryptContext(schemes = ['bcrypt'], deprecated = 'auto', bcrypt__rounds = BCRYPT_ROUNDS)
+
+
+def hash_password(pw : str):
+    return pwd_context.hash(pw)
+
+def verify_and_update(plain_pw : str, hashed_pw : str):
+    return pwd_context.verify_and_update(plain_pw, hashed_pw)
+
+
+class HashingPool:
+    def __init__(self, workers : int, queue_limit : int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.inflight = 0
+        self.rejected = 0
+        self._executor : ProcessPoolExecutor | None = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context = multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures = True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        if self.inflight >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(503, 'Server busy, try again later', headers = {'Retry-After' : '1'})
+        self.inflight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.start(), fn, *args)
+        finally:
+            self.inflight -= 1
+
+    def stats(self):
+        return {
+            'workers' : self.workers,
+            'queue_limit' : self.queue_limit,
+            'inflight' : self.inflight,
+            'rejected' : self.rejected,
+        }
+
+
+hashing_pool = HashingPool(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+async def hash_password_async(pw : str) -> str:
+    return await hashing_pool.run(hash_password, pw)
+
+async def verify_and_update_async(plain_pw : str, hashed_pw : str) -> tuple[bool, str | None]:
+    return await hashing_pool.run(verify_and_update, plain_pw, hashed_pw)
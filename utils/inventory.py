@@ -0,0 +1,107 @@
+from sqlalchemy import bindparam, func, or_, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.order import ORDER_TRANSITION_SOURCES, Order, OrderItem, OrderStatus
+from models.products import Product
+
+# order statuses whose items still hold stock; moving out of them to anything but completed gives it back
+HOLDING_STATUSES = {OrderStatus.pending, OrderStatus.processing}
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids : list[int]):
+        super().__init__(f'Not enough stock for products : {product_ids}')
+        self.product_ids = product_ids
+
+
+product_table = Product.__table__ # type: ignore
+
+# products with stock NULL are not tracked, they always match and stay NULL
+reserve_statement = (
+    update(product_table)
+    .where(product_table.c.id == bindparam('product_id'), or_(product_table.c.stock.is_(None), product_table.c.stock >= bindparam('quantity')))
+    .values(stock = product_table.c.stock - bindparam('quantity'))
+)
+
+release_statement = (
+    update(product_table)
+    .where(product_table.c.id == bindparam('product_id'), product_table.c.stock.is_not(None))
+    .values(stock = product_table.c.stock + bindparam('quantity'))
+)
+
+
+async def order_quantities(session : AsyncSession, order_ids : list[int]):
+    rows = (await session.exec(
+        select(OrderItem.product_id, func.sum(OrderItem.quantity))
+        .where(OrderItem.order_id.in_(order_ids)) # type: ignore
+        .group_by(OrderItem.product_id)
+    )).all()
+    return {product_id : int(quantity) for product_id, quantity in rows}
+
+# one conditional UPDATE per product, sent as a single executemany in product id order so two
+# checkouts sharing products lock them in the same order; nothing is read first, so a hot
+# product is only locked for the length of the checkout's own transaction
+async def reserve_stock(session : AsyncSession, order_id : int):
+    quantities = await order_quantities(session, [order_id])
+    params = [{'product_id' : product_id, 'quantity' : quantities[product_id]} for product_id in sorted(quantities)]
+    if not params:
+        return
+    if session.get_bind().dialect.supports_sane_multi_rowcount:
+        result = await session.execute(reserve_statement, params)
+        if result.rowcount == len(params): # type: ignore
+            return
+        # the caller rolls back, this only names the products that were short
+        raise InsufficientStock(await short_products(session, quantities))
+    short = []
+    for param in params:
+        result = await session.execute(reserve_statement, param)
+        if result.rowcount != 1: # type: ignore
+            short.append(param['product_id'])
+    if short:
+        raise InsufficientStock(short)
+
+async def short_products(session : AsyncSession, quantities : dict[int, int]):
+    rows = (await session.exec(select(Product.id, Product.stock).where(Product.id.in_(quantities)))).all() # type: ignore
+    return sorted(id for id, stock in rows if stock is not None and stock < quantities[id])
+
+async def release_stock(session : AsyncSession, order_ids : list[int]):
+    quantities = await order_quantities(session, order_ids)
+    if quantities:
+        await session.execute(release_statement, [{'product_id' : product_id, 'quantity' : quantities[product_id]} for product_id in sorted(quantities)])
+
+# only along ORDER_TRANSITIONS and only from the status the order was read in, so of two concurrent
+# cancels only one gives the stock back; False when the move is not allowed or lost that race
+async def close_order(session : AsyncSession, order : Order, status : OrderStatus):
+    if not order.can_transition(status):
+        return False
+    previous = OrderStatus(order.status)
+    result = await session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == previous) # type: ignore
+        .values(status = status)
+        .execution_options(synchronize_session = False)
+    )
+    if result.rowcount != 1: # type: ignore
+        return False
+    if previous in HOLDING_STATUSES and status not in HOLDING_STATUSES and status != OrderStatus.completed:
+        await release_stock(session, [order.id]) # type: ignore
+    set_committed_value(order, 'status', status)
+    return True
+
+# expires a batch of pending orders and gives their stock back; only the rows this statement
+# changed are released, with RETURNING where the dialect has it and otherwise relying on the
+# caller holding the rows locked
+async def expire_orders(session : AsyncSession, order_ids : list[int]):
+    # every status an order can expire from holds stock, so each changed row is released
+    statement = update(Order).where(Order.id.in_(order_ids), Order.status.in_(ORDER_TRANSITION_SOURCES[OrderStatus.expired])).values(status = OrderStatus.expired) # type: ignore
+    if session.get_bind().dialect.update_returning:
+        expired = list((await session.execute(statement.returning(Order.id))).scalars()) # type: ignore
+    else:
+        result = await session.execute(statement)
+        expired = order_ids if result.rowcount == len(order_ids) else list((await session.exec( # type: ignore
+            select(Order.id).where(Order.id.in_(order_ids), Order.status == OrderStatus.expired) # type: ignore
+        )).all())
+    if expired:
+        await release_stock(session, expired) # type: ignore
+    return len(expired)
@@ -0,0 +1,196 @@
+import logging
+import re
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+import httpx
+from sqlalchemy import event
+from utils.settings import settings
+
+METRICS_QUERY_BUDGET = settings.metrics_query_budget
+METRICS_TOKEN = settings.metrics_token
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    def __init__(self, name : str, help : str, buckets : tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series : dict[tuple, list] = {}
+        self._lock = Lock()
+
+    def observe(self, value : float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f'{self.name}_sum{format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{format_labels(key)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name : str, help : str):
+        self.name = name
+        self.help = help
+        self._series : dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def inc(self, value : float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        lines.extend(f'{self.name}{format_labels(key)} {value}' for key, value in series)
+        return lines
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.paypal_time = 0.0
+
+
+request_latency = Histogram('http_request_duration_seconds', 'Time spent handling a request', LATENCY_BUCKETS)
+request_queries = Histogram('http_request_db_queries', 'SQL statements executed per request', QUERY_BUCKETS)
+request_db_time = Histogram('http_request_db_seconds', 'Time spent in SQL statements per request', LATENCY_BUCKETS)
+query_budget_exceeded = Counter('http_request_query_budget_exceeded_total', 'Requests that executed more than METRICS_QUERY_BUDGET SQL statements')
+paypal_latency = Histogram('paypal_request_duration_seconds', 'Time spent waiting on PayPal API calls', LATENCY_BUCKETS)
+
+current_request : ContextVar[RequestStats | None] = ContextVar('current_request', default = None)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(key : tuple):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in key) + '}'
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info['query_start'].pop()
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+
+PAYPAL_ID_SEGMENT = re.compile(r'(/v2/checkout/orders)/[^/]+')
+
+async def on_paypal_request(request : httpx.Request):
+    request.extensions['metrics_start'] = perf_counter()
+
+async def on_paypal_response(response : httpx.Response):
+    request = response.request
+    elapsed = perf_counter() - request.extensions.get('metrics_start', perf_counter())
+    endpoint = PAYPAL_ID_SEGMENT.sub(r'\1/{id}', request.url.path)
+    paypal_latency.observe(elapsed, method = request.method, endpoint = endpoint, status = response.status_code)
+    stats = current_request.get()
+    if stats is not None:
+        stats.paypal_time += elapsed
+
+def paypal_event_hooks():
+    return {'request' : [on_paypal_request], 'response' : [on_paypal_response]}
+
+
+def route_template(scope):
+    # FastAPI versions that keep included routers nested only carry the prefixed path on the route context
+    context = scope.get('fastapi', {}).get('effective_route_context')
+    return getattr(context, 'path', None) or getattr(scope.get('route'), 'path', None) or 'unmatched'
+
+
+class MetricsMiddleware:
+    def __init__(self, app, query_budget : int = METRICS_QUERY_BUDGET):
+        self.app = app
+        self.query_budget = query_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        start = perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                timing = f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"'
+                if stats.paypal_time:
+                    timing += f', paypal;dur={stats.paypal_time * 1000:.1f}'
+                message.setdefault('headers', []).append((b'server-timing', timing.encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = perf_counter() - start
+            route = route_template(scope)
+            method = scope['method']
+            request_latency.observe(elapsed, method = method, route = route, status = status)
+            request_queries.observe(stats.queries, method = method, route = route)
+            request_db_time.observe(stats.db_time, method = method, route = route)
+            if stats.queries > self.query_budget:
+                query_budget_exceeded.inc(method = method, route = route)
+                logger.warning('%s %s ran %d queries (budget %d)', method, route, stats.queries, self.query_budget)
+
+
+# flattens the stats dicts the pools, caches and workers already expose; keys of the
+# outermost nested dicts become the label, everything deeper is joined into the name
+def gauge_lines(name : str, value, label : str | None = None, labels : tuple = ()):
+    if isinstance(value, bool):
+        return [f'{name}{format_labels(labels)} {int(value)}']
+    if isinstance(value, (int, float)):
+        return [f'{name}{format_labels(labels)} {value}']
+    if not isinstance(value, dict):
+        return []
+    lines = []
+    for key, item in value.items():
+        if label and isinstance(item, dict):
+            lines.extend(gauge_lines(name, item, None, labels + ((label, key),)))
+        else:
+            lines.extend(gauge_lines(f'{name}_{key}', item, None, labels))
+    return lines
+
+def render_metrics(gauges : dict[str, tuple[str | None, dict]]):
+    lines = []
+    for metric in (request_latency, request_queries, request_db_time, query_budget_exceeded, paypal_latency):
+        lines.extend(metric.render())
+    for name, (label, stats) in gauges.items():
+        lines.extend(gauge_lines(name, stats, label))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,54 @@
+import base64
+import json
+from decimal import Decimal
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlmodel import asc, desc
+
+
+def encode_cursor(sort_by : str, order : str, value, id : int):
+    if isinstance(value, Decimal):
+        value = str(value)
+    raw = json.dumps([sort_by, order, value, id], separators = (',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor : str, sort_by : str, order : str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort_by, cursor_order, value, id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(400, 'Invalid cursor')
+    if cursor_sort_by != sort_by or cursor_order != order:
+        raise HTTPException(400, 'Cursor does not match sort_by and order')
+    return value, int(id)
+
+def paginate(query, sort_column, id_column, filter_params, cursor_value = None):
+    order = filter_params.order
+    to_order = desc if order == 'desc' else asc
+    if sort_column is id_column:
+        query = query.order_by(to_order(id_column))
+    else:
+        query = query.order_by(to_order(sort_column), to_order(id_column))
+
+    if not filter_params.cursor:
+        return query.offset(filter_params.offset).limit(filter_params.limit)
+
+    value, last_id = decode_cursor(filter_params.cursor, filter_params.sort_by, order)
+    if cursor_value is not None and value is not None:
+        try:
+            value = cursor_value(value)
+        except (ValueError, ArithmeticError):
+            raise HTTPException(400, 'Invalid cursor')
+    if sort_column is id_column:
+        after = id_column < last_id if order == 'desc' else id_column > last_id
+    elif order == 'desc':
+        after = or_(sort_column < value, and_(sort_column == value, id_column < last_id))
+    else:
+        after = or_(sort_column > value, and_(sort_column == value, id_column > last_id))
+    return query.where(after).limit(filter_params.limit)
+
+def next_cursor(rows, sort_attr : str, filter_params):
+    if len(rows) < filter_params.limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(filter_params.sort_by, filter_params.order, getattr(last, sort_attr), last.id)
@@ -0,0 +1,125 @@
+import asyncio
+import random
+from importlib.util import find_spec
+from time import monotonic
+from fastapi import Request
+import httpx
+from utils.settings import settings
+
+PAYPAL_API_BASE_URL = settings.paypal_api_base_url
+PAYPAL_CLIENT_ID = settings.paypal_client_id
+PAYPAL_SECRET_KEY = settings.paypal_secret_key
+PAYPAL_ACCESS_TOKEN = settings.paypal_access_token
+PAYPAL_TIMEOUT = settings.paypal_timeout
+PAYPAL_CONNECT_TIMEOUT = settings.paypal_connect_timeout
+PAYPAL_MAX_CONNECTIONS = settings.paypal_max_connections
+PAYPAL_MAX_KEEPALIVE = settings.paypal_max_keepalive
+PAYPAL_RETRIES = settings.paypal_retries
+PAYPAL_BACKOFF = settings.paypal_backoff
+PAYPAL_TOKEN_SKEW = settings.paypal_token_skew
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PayPalTokenManager:
+    def __init__(self, http : httpx.AsyncClient, client_id : str | None, secret : str | None,
+                 static_token : str | None = None, skew : float = PAYPAL_TOKEN_SKEW):
+        self.http = http
+        self.client_id = client_id
+        self.secret = secret
+        self.static_token = static_token
+        self.skew = skew
+        self.refreshes = 0
+        self._token : str | None = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _valid(self):
+        return self._token is not None and monotonic() < self._expires_at - self.skew
+
+    async def get_token(self) -> str:
+        if self._valid():
+            return self._token # type: ignore
+        async with self._lock:
+            if not self._valid():
+                await self._refresh()
+        return self._token # type: ignore
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    async def _refresh(self):
+        if not self.client_id or not self.secret:
+            if not self.static_token:
+                raise RuntimeError('PAYPAL_CLIENT_ID and PAYPAL_SECRET_KEY or PAYPAL_ACCESS_TOKEN must be set')
+            self._token = self.static_token
+            self._expires_at = float('inf')
+            return
+        response = await self.http.post(
+            '/v1/oauth2/token',
+            data = {'grant_type' : 'client_credentials'},
+            auth = (self.client_id, self.secret),
+            headers = {'Content-Type' : 'application/x-www-form-urlencoded'}
+        )
+        response.raise_for_status()
+        token_data = response.json()
+        self._token = token_data['access_token']
+        self._expires_at = monotonic() + float(token_data.get('expires_in', 3600))
+        self.refreshes += 1
+
+
+class PayPalClient:
+    def __init__(self, base_url : str = PAYPAL_API_BASE_URL, transport : httpx.AsyncBaseTransport | None = None,
+                 client_id : str | None = PAYPAL_CLIENT_ID, secret : str | None = PAYPAL_SECRET_KEY,
+                 static_token : str | None = PAYPAL_ACCESS_TOKEN, retries : int = PAYPAL_RETRIES,
+                 backoff : float = PAYPAL_BACKOFF, event_hooks : dict | None = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.http = httpx.AsyncClient(
+            base_url = base_url,
+            transport = transport,
+            http2 = transport is None and find_spec('h2') is not None,
+            timeout = httpx.Timeout(PAYPAL_TIMEOUT, connect = PAYPAL_CONNECT_TIMEOUT),
+            limits = httpx.Limits(max_connections = PAYPAL_MAX_CONNECTIONS, max_keepalive_connections = PAYPAL_MAX_KEEPALIVE),
+            event_hooks = event_hooks
+        )
+        self.tokens = PayPalTokenManager(self.http, client_id, secret, static_token)
+
+    async def _sleep(self, attempt : int):
+        await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    async def request(self, method : str, path : str, json : dict | None = None, request_id : str | None = None):
+        attempt = 0
+        while True:
+            headers = {
+                'Content-Type' : 'application/json',
+                'Authorization' : f'Bearer {await self.tokens.get_token()}'
+            }
+            if request_id:
+                headers['PayPal-Request-Id'] = request_id
+            try:
+                response = await self.http.request(method, path, json = json, headers = headers)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+            else:
+                if response.status_code == 401 and attempt < self.retries:
+                    self.tokens.invalidate()
+                elif response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            await self._sleep(attempt)
+            attempt += 1
+
+    async def create_order(self, payload : dict, request_id : str):
+        return await self.request('POST', '/v2/checkout/orders', payload, request_id)
+
+    async def capture_order(self, paypal_order_id : str):
+        return await self.request('POST', f'/v2/checkout/orders/{paypal_order_id}/capture', request_id = f'capture-{paypal_order_id}')
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def get_paypal(request : Request) -> PayPalClient:
+    return request.app.state.paypal
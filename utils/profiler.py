@@ -0,0 +1,294 @@
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import monotonic, perf_counter, sleep
+from sqlalchemy import event
+from utils.metrics import route_template
+from utils.settings import settings
+
+PROFILE_ENABLED = settings.profile_enabled
+PROFILE_SAMPLE_RATE = settings.profile_sample_rate
+PROFILE_SLOW_MS = settings.profile_slow_ms
+PROFILE_INTERVAL_MS = settings.profile_interval_ms
+PROFILE_DIR = settings.profile_dir
+PROFILE_KEEP = settings.profile_keep
+PROFILE_SETTINGS_FILE = settings.profile_settings_file
+PROFILE_POLL_INTERVAL = settings.profile_poll_interval
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_DEPTH = 128
+MAX_STATEMENTS = 500
+SAMPLE_BUFFER = 50000
+SETTINGS = ('enabled', 'sample_rate', 'slow_ms')
+
+
+class Profile:
+    def __init__(self, method : str, path : str, sampled : bool):
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started_at = datetime.now(timezone.utc)
+        self.start = perf_counter()
+        self.task = asyncio.current_task()
+        self.loop_thread = threading.get_ident()
+        # threadpool workers that ran SQL for this request; their samples inside the request window are kept
+        self.threads : set[int] = set()
+        self.statements : list[dict] = []
+
+
+class Profiler:
+    def __init__(self, directory : str, keep : int, interval : float, settings_file : str, poll_interval : float,
+                 enabled : bool, sample_rate : float, slow_ms : float):
+        self.directory = directory
+        self.keep = keep
+        self.interval = interval
+        self.settings_file = settings_file
+        self.poll_interval = poll_interval
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.profiled = 0
+        self.written = 0
+        self._active : dict[int, Profile] = {}
+        self._loops : dict[int, asyncio.AbstractEventLoop] = {}
+        self._samples : deque = deque(maxlen = SAMPLE_BUFFER)
+        self._labels : dict = {}
+        self._app_codes : set = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread : threading.Thread | None = None
+        self._settings_mtime = 0.0
+        self._polled_at = 0.0
+
+    def settings(self):
+        return {'enabled' : self.enabled, 'sample_rate' : self.sample_rate, 'slow_ms' : self.slow_ms}
+
+    def poll_settings(self):
+        # every worker process picks up changes made through the admin endpoint in any of them
+        now = monotonic()
+        if now - self._polled_at < self.poll_interval:
+            return
+        self._polled_at = now
+        try:
+            mtime = os.path.getmtime(self.settings_file)
+        except OSError:
+            return
+        if mtime == self._settings_mtime:
+            return
+        try:
+            with open(self.settings_file) as file:
+                settings = json.load(file)
+        except (OSError, ValueError):
+            return
+        self._settings_mtime = mtime
+        self._apply(settings)
+
+    def _apply(self, settings : dict):
+        self.enabled = bool(settings.get('enabled', self.enabled))
+        self.sample_rate = min(max(float(settings.get('sample_rate', self.sample_rate)), 0.0), 1.0)
+        self.slow_ms = float(settings['slow_ms']) if settings.get('slow_ms') is not None else None # type: ignore
+
+    def update(self, settings : dict):
+        self._apply({**self.settings(), **{key : value for key, value in settings.items() if key in SETTINGS}})
+        os.makedirs(os.path.dirname(self.settings_file) or '.', exist_ok = True)
+        with open(f'{self.settings_file}.tmp', 'w') as file:
+            json.dump(self.settings(), file)
+        os.replace(f'{self.settings_file}.tmp', self.settings_file)
+        self._settings_mtime = os.path.getmtime(self.settings_file)
+        return self.settings()
+
+    def begin(self, method : str, path : str):
+        self.poll_settings()
+        if not self.enabled:
+            return None
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_ms is None:
+            return None
+        profile = Profile(method, path, sampled)
+        with self._lock:
+            self._active[id(profile)] = profile
+            self._loops[profile.loop_thread] = asyncio.get_running_loop()
+        self._ensure_sampler()
+        self._wakeup.set()
+        return profile
+
+    async def end(self, profile : Profile, route : str, status : int):
+        end = perf_counter()
+        elapsed_ms = (end - profile.start) * 1000
+        keep = profile.sampled or (self.slow_ms is not None and elapsed_ms >= self.slow_ms)
+        samples = []
+        with self._lock:
+            self._active.pop(id(profile), None)
+            if keep:
+                # the buffer is in time order, only the request's own window is walked
+                for sample in reversed(self._samples):
+                    if sample[0] < profile.start:
+                        break
+                    if sample[0] <= end:
+                        samples.append(sample)
+            if not self._active:
+                self._samples.clear()
+        self.profiled += 1
+        if not keep:
+            return None
+        stacks = Counter()
+        for at, thread_id, task, stack, in_app in samples:
+            # an idle threadpool worker has no application frames on its stack
+            if (thread_id == profile.loop_thread and task is profile.task) or (thread_id in profile.threads and in_app):
+                stacks[stack] += 1
+        # file writes and the directory listing in rotate stay off the event loop
+        return await asyncio.to_thread(self.write, profile, route, status, elapsed_ms, stacks)
+
+    def write(self, profile : Profile, route : str, status : int, elapsed_ms : float, stacks : Counter):
+        os.makedirs(self.directory, exist_ok = True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        name = f"{profile.started_at.strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}-{profile.method}-{slug}-{elapsed_ms:.0f}ms"
+        base = os.path.join(self.directory, name)
+        with open(f'{base}.folded', 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{';'.join(stack)} {count}\n")
+        with open(f'{base}.json', 'w') as file:
+            json.dump({
+                'method' : profile.method,
+                'path' : profile.path,
+                'route' : route,
+                'status' : status,
+                'started_at' : profile.started_at.isoformat(),
+                'duration_ms' : elapsed_ms,
+                'sampled' : profile.sampled,
+                'interval_ms' : self.interval * 1000,
+                'samples' : sum(stacks.values()),
+                'sql_count' : len(profile.statements),
+                'sql_ms' : sum(statement['ms'] for statement in profile.statements),
+                'sql' : profile.statements[:MAX_STATEMENTS],
+            }, file, indent = 2)
+        self.written += 1
+        self.rotate()
+        return name
+
+    def rotate(self):
+        names = sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json') and name != os.path.basename(self.settings_file))
+        for name in names[:-self.keep] if self.keep else []:
+            for suffix in ('.json', '.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self, limit : int = 50):
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted((name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json') and name != os.path.basename(self.settings_file)), reverse = True)
+        return names[:limit]
+
+    def record_statement(self, statement : str, seconds : float):
+        profile = current_profile.get()
+        if profile is None:
+            return
+        profile.threads.add(threading.get_ident())
+        if len(profile.statements) < MAX_STATEMENTS:
+            profile.statements.append({'at_ms' : (perf_counter() - profile.start - seconds) * 1000, 'ms' : seconds * 1000, 'sql' : statement})
+
+    def _ensure_sampler(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target = self._sample_loop, name = 'profiler-sampler', daemon = True)
+            self._thread.start()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            if code.co_filename.startswith(APP_ROOT) and 'site-packages' not in code.co_filename:
+                self._app_codes.add(code)
+        return label
+
+    def _stack(self, frame):
+        stack = []
+        in_app = False
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(self._label(frame.f_code))
+            in_app = in_app or frame.f_code in self._app_codes
+            frame = frame.f_back
+        return tuple(reversed(stack)), in_app
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while True:
+            if not self._active:
+                self._wakeup.clear()
+                if not self._active:
+                    self._wakeup.wait()
+            at = perf_counter()
+            loops = dict(self._loops)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                loop = loops.get(thread_id)
+                task = asyncio.current_task(loop) if loop is not None else None
+                stack, in_app = self._stack(frame)
+                self._samples.append((at, thread_id, task, stack, in_app))
+            sleep(self.interval)
+
+    def stats(self):
+        return {
+            **self.settings(),
+            'interval_ms' : self.interval * 1000,
+            'directory' : self.directory,
+            'keep' : self.keep,
+            'active' : len(self._active),
+            'profiled' : self.profiled,
+            'written' : self.written,
+        }
+
+
+current_profile : ContextVar[Profile | None] = ContextVar('current_profile', default = None)
+
+profiler = Profiler(PROFILE_DIR, PROFILE_KEEP, PROFILE_INTERVAL_MS / 1000, PROFILE_SETTINGS_FILE, PROFILE_POLL_INTERVAL,
+                    PROFILE_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS)
+
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            conn.info['profile_start'] = perf_counter()
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('profile_start', None)
+        if start is not None:
+            profiler.record_statement(statement, perf_counter() - start)
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        profile = profiler.begin(scope['method'], scope['path'])
+        if profile is None:
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            await profiler.end(profile, route_template(scope), status)
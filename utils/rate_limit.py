@@ -0,0 +1,234 @@
+import logging
+from collections import OrderedDict
+from math import ceil
+from threading import Lock
+from time import monotonic
+from fastapi import HTTPException, Request
+from utils.auth_utils import decode_access_token
+from utils.settings import settings
+
+RATE_LIMIT_ENABLED = settings.rate_limit_enabled
+RATE_LIMIT_BACKEND = settings.rate_limit_backend
+RATE_LIMIT_CAPACITY = settings.rate_limit_capacity
+RATE_LIMIT_REFILL_RATE = settings.rate_limit_refill_rate
+RATE_LIMIT_MAX_KEYS = settings.rate_limit_max_keys
+RATE_LIMIT_TRUST_FORWARDED = settings.rate_limit_trust_forwarded
+RATE_LIMIT_AUTH_COST = settings.rate_limit_auth_cost
+RATE_LIMIT_CHECKOUT_COST = settings.rate_limit_checkout_cost
+RATE_LIMIT_SEARCH_COST = settings.rate_limit_search_cost
+ROUTER_CONCURRENCY_LIMIT = settings.router_concurrency_limit
+REDIS_URL = settings.redis_url
+
+KEY_PREFIX = 'ratelimit:'
+LOOPBACK_HOSTS = {'127.0.0.1', '::1'}
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucketBackend:
+    def __init__(self, max_keys : int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.evictions = 0
+        self._buckets : OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = Lock()
+
+    # returns 0 when the tokens were taken, otherwise the seconds until enough have refilled
+    def take(self, key : str, cost : float, capacity : float, rate : float) -> float:
+        now = monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+                # an evicted key comes back with a full bucket, it was the least recently seen one
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last = False)
+                    self.evictions += 1
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / rate
+
+    def stats(self):
+        return {
+            'backend' : 'memory',
+            'keys' : len(self._buckets),
+            'max_keys' : self.max_keys,
+            'evictions' : self.evictions,
+        }
+
+
+# the same refill and take as the memory backend in one script, so every worker shares the
+# bucket; Redis' clock is used for refills and idle buckets expire once they would be full again
+TAKE_SCRIPT = '''
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+'''
+
+
+class RedisBucketBackend:
+    def __init__(self, client):
+        self.client = client
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key : str, cost : float, capacity : float, rate : float) -> float:
+        return float(self._take(keys = [KEY_PREFIX + key], args = [capacity, rate, cost]))
+
+    def stats(self):
+        return {
+            'backend' : 'redis'
+        }
+
+
+def create_bucket_backend(kind : str, url : str | None = None, max_keys : int = RATE_LIMIT_MAX_KEYS):
+    if kind == 'memory':
+        return MemoryBucketBackend(max_keys)
+    if kind == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis rate limit backend requires the redis package')
+        return RedisBucketBackend(redis.Redis.from_url(url or 'redis://localhost:6379/0'))
+    raise ValueError(f'Unknown rate limit backend : {kind}')
+
+
+class RateLimiter:
+    def __init__(self, backend, capacity : float, rate : float, enabled : bool = True):
+        self.backend = backend
+        self.capacity = capacity
+        self.rate = rate
+        self.enabled = enabled
+        self.allowed = 0
+        self.limited = 0
+        self.backend_errors = 0
+
+    def check(self, key : str, cost : float):
+        if not self.enabled:
+            return 0.0
+        try:
+            wait = self.backend.take(key, cost, self.capacity, self.rate)
+        except Exception:
+            # a shared backend that is down must not take the API with it
+            self.backend_errors += 1
+            return 0.0
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self):
+        return {
+            'enabled' : self.enabled,
+            'capacity' : self.capacity,
+            'refill_rate' : self.rate,
+            'allowed' : self.allowed,
+            'limited' : self.limited,
+            'backend_errors' : self.backend_errors,
+            **self.backend.stats(),
+        }
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit : int):
+        self.limit = limit
+        self.rejected = 0
+        self._in_flight : dict[str, int] = {}
+        self._lock = Lock()
+
+    def acquire(self, name : str):
+        with self._lock:
+            in_flight = self._in_flight.get(name, 0)
+            if self.limit and in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self._in_flight[name] = in_flight + 1
+            return True
+
+    def release(self, name : str):
+        with self._lock:
+            self._in_flight[name] -= 1
+
+    def stats(self):
+        return {
+            'limit' : self.limit,
+            'rejected' : self.rejected,
+            'in_flight' : dict(self._in_flight),
+        }
+
+
+rate_limiter = RateLimiter(create_bucket_backend(RATE_LIMIT_BACKEND, REDIS_URL), RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL_RATE, RATE_LIMIT_ENABLED)
+router_concurrency = ConcurrencyLimiter(ROUTER_CONCURRENCY_LIMIT if RATE_LIMIT_ENABLED else 0)
+
+
+def client_key(request : Request):
+    # a valid bearer token identifies the user without a query, the token payload is cached
+    authorization = request.headers.get('authorization', '')
+    if authorization[:7].lower() == 'bearer ':
+        payload = decode_access_token(authorization[7:])
+        if payload and 'sub' in payload:
+            return f"user:{payload['sub']}"
+    if RATE_LIMIT_TRUST_FORWARDED and request.headers.get('x-forwarded-for'):
+        return f"ip:{request.headers['x-forwarded-for'].split(',')[0].strip()}"
+    host = request.client.host if request.client else 'unknown'
+    if host in LOOPBACK_HOSTS:
+        warn_loopback()
+    return f'ip:{host}'
+
+loopback_warned = False
+
+# uvicorn already swaps in the X-Forwarded-For address of a proxy in FORWARDED_ALLOW_IPS, a loopback
+# peer left here means a local proxy that does not send it and every anonymous client in one bucket
+def warn_loopback():
+    global loopback_warned
+    if not loopback_warned:
+        loopback_warned = True
+        logger.warning('Anonymous request from a loopback address: without X-Forwarded-For from the proxy, or '
+                       'RATE_LIMIT_TRUST_FORWARDED, every anonymous client shares one rate limit bucket')
+
+# every route pays one token through the router dependency, expensive ones add their own cost on
+# top; with a query parameter given the extra cost only applies when that parameter is present
+def rate_limit(cost : float = 1, param : str | None = None):
+    async def dependency(request : Request):
+        # no key to derive, and no loopback warning, when the limiter is off
+        if not rate_limiter.enabled or (param and not request.query_params.get(param)):
+            return
+        wait = rate_limiter.check(client_key(request), cost)
+        if wait:
+            raise HTTPException(429, 'Too many requests', headers = {'Retry-After' : str(ceil(wait))})
+    return dependency
+
+def concurrency_limit(name : str):
+    async def dependency():
+        if not router_concurrency.acquire(name):
+            raise HTTPException(429, 'Too many concurrent requests', headers = {'Retry-After' : '1'})
+        try:
+            yield
+        finally:
+            router_concurrency.release(name)
+    return dependency
+
+def get_rate_limit_stats():
+    return {
+        'buckets' : rate_limiter.stats(),
+        'routers' : router_concurrency.stats(),
+    }
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from time import perf_counter
+from sqlalchemy import and_, delete, exists, func, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.database import async_engine
+from models.order import CaptureJob, Order, OrderItem, OrderStatus, OrderSummary
+from utils.inventory import expire_orders
+from utils.settings import settings
+
+REAPER_ENABLED = settings.reaper_enabled
+REAPER_INTERVAL = settings.reaper_interval
+REAPER_BATCH_SIZE = settings.reaper_batch_size
+PENDING_ORDER_TTL_MINUTES = settings.pending_order_ttl_minutes
+ARCHIVE_AFTER_DAYS = settings.archive_after_days
+ARCHIVE_STATUSES = [OrderStatus(status) for status in settings.archive_statuses]
+
+SKIP_LOCKED_DIALECTS = {'mysql', 'postgresql'}
+ACTIVE_JOB_STATUSES = ['queued', 'running']
+
+logger = logging.getLogger(__name__)
+
+
+def after(created_at : datetime, id : int):
+    return or_(Order.created_at > created_at, and_(Order.created_at == created_at, Order.id > id)) # type: ignore
+
+
+class OrderReaper:
+    def __init__(self, interval : float, batch_size : int, pending_ttl : timedelta, archive_after : timedelta | None, archive_statuses : list[OrderStatus]):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending_ttl = pending_ttl
+        self.archive_after = archive_after
+        self.archive_statuses = archive_statuses
+        self.runs = 0
+        self.batches = 0
+        self.expired = 0
+        self.archived = 0
+        self.errors = 0
+        self.last_run_at : datetime | None = None
+        self.last_duration_ms = 0.0
+        self._task : asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name = 'order-reaper')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions = True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.errors += 1
+                logger.exception('Order reaper failed')
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        start = perf_counter()
+        async with AsyncSession(async_engine, expire_on_commit = False) as session:
+            expired = await self.expire_pending(session)
+            archived = await self.archive_terminal(session) if self.archive_after else 0
+        self.runs += 1
+        self.last_run_at = datetime.now(timezone.utc)
+        self.last_duration_ms = (perf_counter() - start) * 1000
+        return expired, archived
+
+    def _batch(self, session : AsyncSession, query):
+        query = query.order_by(Order.created_at, Order.id).limit(self.batch_size) # type: ignore
+        # rows a live checkout or another worker holds are left for the next batch instead of waited on
+        if session.get_bind().dialect.name in SKIP_LOCKED_DIALECTS:
+            query = query.with_for_update(skip_locked = True)
+        return query
+
+    async def expire_pending(self, session : AsyncSession):
+        cutoff = datetime.now(timezone.utc) - self.pending_ttl
+        active_job = exists().where(CaptureJob.order_id == Order.id, CaptureJob.status.in_(ACTIVE_JOB_STATUSES)) # type: ignore
+        query = select(Order.id, Order.created_at).where(Order.status == OrderStatus.pending, Order.created_at < cutoff, ~active_job)
+        total = 0
+        last = None
+        while True:
+            rows = (await session.exec(self._batch(session, query.where(after(*last)) if last else query))).all()
+            if not rows:
+                break
+            total += await expire_orders(session, [id for id, _ in rows])
+            await session.commit()
+            self.batches += 1
+            last = rows[-1][1], rows[-1][0]
+            if len(rows) < self.batch_size:
+                break
+        self.expired += total
+        return total
+
+    async def archive_terminal(self, session : AsyncSession):
+        cutoff = datetime.now(timezone.utc) - self.archive_after # type: ignore
+        query = select(Order.id, Order.created_at, Order.status, Order.total_price).where(Order.status.in_(self.archive_statuses), Order.created_at < cutoff) # type: ignore
+        total = 0
+        while True:
+            rows = (await session.exec(self._batch(session, query))).all()
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            items = dict((await session.exec(
+                select(OrderItem.order_id, func.sum(OrderItem.quantity)).where(OrderItem.order_id.in_(ids)).group_by(OrderItem.order_id) # type: ignore
+            )).all())
+            summary = defaultdict(lambda: [0, 0, Decimal(0)])
+            for row in rows:
+                counts = summary[(row.created_at.date(), row.status)]
+                counts[0] += 1
+                counts[1] += int(items.get(row.id) or 0)
+                counts[2] += row.total_price or Decimal(0)
+            await session.execute(upsert_summary(session, summary))
+            await session.execute(delete(OrderItem).where(OrderItem.order_id.in_(ids))) # type: ignore
+            await session.execute(delete(CaptureJob).where(CaptureJob.order_id.in_(ids))) # type: ignore
+            await session.execute(delete(Order).where(Order.id.in_(ids))) # type: ignore
+            await session.commit()
+            total += len(rows)
+            self.batches += 1
+            if len(rows) < self.batch_size:
+                break
+        self.archived += total
+        return total
+
+    def stats(self):
+        return {
+            'enabled' : self._task is not None,
+            'interval_s' : self.interval,
+            'batch_size' : self.batch_size,
+            'pending_ttl_s' : self.pending_ttl.total_seconds(),
+            'archive_after_s' : self.archive_after.total_seconds() if self.archive_after else None,
+            'runs' : self.runs,
+            'batches' : self.batches,
+            'expired' : self.expired,
+            'archived' : self.archived,
+            'errors' : self.errors,
+            'last_run_at' : self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_duration_ms' : self.last_duration_ms,
+        }
+
+
+def upsert_summary(session : AsyncSession, summary : dict):
+    table = OrderSummary.__table__ # type: ignore
+    values = [
+        {'day' : day, 'status' : status, 'order_count' : orders, 'item_count' : items, 'total_price' : amount}
+        for (day, status), (orders, items, amount) in summary.items()
+    ]
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql_insert(table).values(values)
+        return stmt.on_duplicate_key_update(
+            order_count = table.c.order_count + stmt.inserted.order_count,
+            item_count = table.c.item_count + stmt.inserted.item_count,
+            total_price = table.c.total_price + stmt.inserted.total_price
+        )
+    stmt = (postgresql_insert if dialect == 'postgresql' else sqlite_insert)(table).values(values)
+    return stmt.on_conflict_do_update(
+        index_elements = ['day', 'status'],
+        set_ = {
+            'order_count' : table.c.order_count + stmt.excluded.order_count,
+            'item_count' : table.c.item_count + stmt.excluded.item_count,
+            'total_price' : table.c.total_price + stmt.excluded.total_price
+        }
+    )
+
+
+order_reaper = OrderReaper(
+    REAPER_INTERVAL,
+    REAPER_BATCH_SIZE,
+    timedelta(minutes = PENDING_ORDER_TTL_MINUTES),
+    timedelta(days = ARCHIVE_AFTER_DAYS) if ARCHIVE_AFTER_DAYS else None,
+    ARCHIVE_STATUSES
+)
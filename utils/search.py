@@ -0,0 +1,246 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from decimal import Decimal
+from math import log
+from threading import RLock
+from sqlmodel import Session, select
+from models.products import Product
+from utils.settings import settings
+
+SEARCH_INDEX_ENABLED = settings.search_index_enabled
+SEARCH_MIN_PREFIX = settings.search_min_prefix
+SEARCH_MAX_CANDIDATES = settings.search_max_candidates
+
+TOKEN_RE = re.compile(r'\w+')
+NAME_WEIGHT = 3.0
+K1 = 1.2
+B = 0.75
+PREFIX_PENALTY = 0.9
+
+
+def tokenize(text : str):
+    return TOKEN_RE.findall(text.lower())
+
+
+class ProductSearchIndex:
+    def __init__(self, min_prefix : int = SEARCH_MIN_PREFIX, max_candidates : int = SEARCH_MAX_CANDIDATES):
+        self.min_prefix = min_prefix
+        self.max_candidates = max_candidates
+        self.ready = False
+        self._postings : dict[str, dict[int, float]] = {}
+        self._terms : list[str] = []
+        self._doc_terms : dict[int, tuple[str, ...]] = {}
+        self._doc_len : dict[int, float] = {}
+        self._prices : dict[int, Decimal] = {}
+        self._ranked_cache : dict[str, list[int]] = {}
+        self._total_len = 0.0
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def _weights(self, name : str, description : str):
+        weights = Counter()
+        for term in tokenize(name):
+            weights[term] += NAME_WEIGHT
+        for term in tokenize(description):
+            weights[term] += 1.0
+        return weights
+
+    def _insert(self, id : int, name : str, description : str, price, sort_terms : bool):
+        weights = self._weights(name, description)
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                if sort_terms:
+                    insort(self._terms, term)
+                else:
+                    self._terms.append(term)
+            postings[id] = weight
+            self._ranked_cache.pop(term, None)
+        self._doc_terms[id] = tuple(weights)
+        self._doc_len[id] = sum(weights.values())
+        self._total_len += self._doc_len[id]
+        self._prices[id] = Decimal(price) if price is not None else Decimal(0)
+
+    def _delete(self, id : int):
+        terms = self._doc_terms.pop(id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[id]
+            self._ranked_cache.pop(term, None)
+            if not postings:
+                del self._postings[term]
+                index = bisect_left(self._terms, term)
+                if index < len(self._terms) and self._terms[index] == term:
+                    del self._terms[index]
+        self._total_len -= self._doc_len.pop(id)
+        del self._prices[id]
+
+    # built aside and swapped in, so a rebuild after another worker's write does not hold up searches
+    def build(self, rows):
+        fresh = ProductSearchIndex(self.min_prefix, self.max_candidates)
+        for id, name, description, price in rows:
+            fresh._insert(id, name, description, price, sort_terms = False)
+        fresh._terms.sort()
+        if fresh._doc_terms:
+            avg_len = fresh._total_len / len(fresh._doc_terms)
+            for term in fresh._postings:
+                fresh._ranked(term, avg_len)
+        with self._lock:
+            self._postings = fresh._postings
+            self._terms = fresh._terms
+            self._doc_terms = fresh._doc_terms
+            self._doc_len = fresh._doc_len
+            self._prices = fresh._prices
+            self._ranked_cache = fresh._ranked_cache
+            self._total_len = fresh._total_len
+            self.ready = True
+
+    def add(self, id : int, name : str, description : str, price):
+        with self._lock:
+            self._delete(id)
+            self._insert(id, name, description, price, sort_terms = True)
+
+    def remove(self, id : int):
+        with self._lock:
+            self._delete(id)
+
+    def _expand(self, token : str):
+        if len(token) < self.min_prefix:
+            return [token] if token in self._postings else []
+        start = bisect_left(self._terms, token)
+        end = bisect_left(self._terms, token + '\uffff', start)
+        return self._terms[start:end]
+
+    def _idf(self, term : str, doc_count : int):
+        df = len(self._postings[term])
+        return log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+    def _norm(self, tf : float, id : int, avg_len : float):
+        return tf * (K1 + 1) / (tf + K1 * (1 - B + B * self._doc_len[id] / avg_len))
+
+    def _ranked(self, term : str, avg_len : float):
+        ranked = self._ranked_cache.get(term)
+        if ranked is None:
+            postings = self._postings[term]
+            ranked = self._ranked_cache[term] = sorted(postings, key = lambda id : -self._norm(postings[id], id, avg_len))
+        return ranked
+
+    def _term_weight(self, term : str, token : str, doc_count : int):
+        idf = self._idf(term, doc_count)
+        return idf if term == token else idf * PREFIX_PENALTY
+
+    def _driver_scores(self, token : str, terms : list[str], doc_count : int, avg_len : float, accept):
+        scores : dict[int, float] = {}
+        for term in terms:
+            weight = self._term_weight(term, token, doc_count)
+            for id, tf in self._postings[term].items():
+                score = weight * self._norm(tf, id, avg_len)
+                if score > scores.get(id, 0.0) and accept(id):
+                    scores[id] = score
+        return scores
+
+    def _top_driver_scores(self, token : str, terms : list[str], others : list[str], doc_count : int, avg_len : float, accept):
+        def impacts(term):
+            weight = self._term_weight(term, token, doc_count)
+            postings = self._postings[term]
+            for id in self._ranked(term, avg_len):
+                yield -weight * self._norm(postings[id], id, avg_len), id
+
+        scores : dict[int, float] = {}
+        seen : set[int] = set()
+        for score, id in heapq.merge(*(impacts(term) for term in terms)):
+            if id in seen:
+                continue
+            seen.add(id)
+            if not accept(id):
+                continue
+            # the other tokens are matched before the cap, so it only ever counts real results
+            extra = self._score(id, others, doc_count, avg_len) if others else 0.0
+            if others and not extra:
+                continue
+            scores[id] = extra - score
+            if len(scores) >= self.max_candidates:
+                break
+        return scores
+
+    def _score(self, id : int, tokens : list[str], doc_count : int, avg_len : float):
+        terms = self._doc_terms[id]
+        total = 0.0
+        for token in tokens:
+            prefix = len(token) >= self.min_prefix
+            best = 0.0
+            for term in terms:
+                if term == token or (prefix and term.startswith(token)):
+                    best = max(best, self._term_weight(term, token, doc_count) * self._norm(self._postings[term][id], id, avg_len))
+            if not best:
+                return 0.0
+            total += best
+        return total
+
+    def search(self, query : str, min_price : Decimal | None = None, max_price : Decimal | None = None):
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        def accept(id):
+            price = prices[id]
+            return (min_price is None or price >= min_price) and (max_price is None or price <= max_price)
+
+        with self._lock:
+            # taken under the lock, a rebuild swaps the prices together with the postings
+            prices = self._prices
+            doc_count = len(self._doc_terms)
+            if not doc_count:
+                return []
+            avg_len = self._total_len / doc_count
+            expansions = {token : self._expand(token) for token in tokens}
+            if not all(expansions.values()):
+                return []
+            driver = min(tokens, key = lambda token : sum(len(self._postings[term]) for term in expansions[token]))
+            others = [token for token in tokens if token != driver]
+            if sum(len(self._postings[term]) for term in expansions[driver]) > self.max_candidates:
+                # at most max_candidates results, the best by the driver's impact, so paging ends there
+                scores = self._top_driver_scores(driver, expansions[driver], others, doc_count, avg_len, accept)
+                return sorted(scores, key = lambda id : (-scores[id], id))
+            scores = self._driver_scores(driver, expansions[driver], doc_count, avg_len, accept)
+            for id in list(scores):
+                score = self._score(id, others, doc_count, avg_len) if others else 0.0
+                if others and not score:
+                    del scores[id]
+                else:
+                    scores[id] += score
+        return sorted(scores, key = lambda id : (-scores[id], id))
+
+
+product_index = ProductSearchIndex()
+
+def load_product_index(index : ProductSearchIndex = product_index):
+    # imported here so the index itself, e.g. in benchmarks/search.py, does not build the engines
+    from db.database import engine
+    if not SEARCH_INDEX_ENABLED:
+        return
+    with Session(engine) as session:
+        rows = session.exec(
+            select(Product.id, Product.name, Product.description, Product.price).execution_options(yield_per = 10000)
+        )
+        index.build(rows)
+
+# another worker changed these products; rows that are gone were deleted, no ids rebuilds the index
+def refresh_products(ids : list[int] | None = None, index : ProductSearchIndex = product_index):
+    from db.database import engine
+    if not SEARCH_INDEX_ENABLED:
+        return
+    if ids is None or not index.ready:
+        return load_product_index(index)
+    with Session(engine) as session:
+        rows = session.exec(select(Product.id, Product.name, Product.description, Product.price).where(Product.id.in_(ids))).all() # type: ignore
+    for id, name, description, price in rows:
+        index.add(id, name, description, price) # type: ignore
+    for id in set(ids) - {row[0] for row in rows}:
+        index.remove(id)
@@ -0,0 +1,27 @@
+from decimal import Decimal
+from typing import Any
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+import orjson
+from pydantic import TypeAdapter
+
+
+def encode_default(value):
+    # Decimal goes out as a string, the same as pydantic's JSON mode, so prices keep their precision
+    if isinstance(value, Decimal):
+        return str(value)
+    return jsonable_encoder(value)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content : Any) -> bytes:
+        return orjson.dumps(content, default = encode_default, option = orjson.OPT_NON_STR_KEYS)
+
+
+def orm_json(adapter : TypeAdapter, rows) -> bytes:
+    return adapter.dump_json(adapter.validate_python(rows, from_attributes = True))
+
+# rows straight from the ORM are validated once from their attributes and written by pydantic-core,
+# returning a Response skips FastAPI validating the same list again against response_model
+def orm_response(adapter : TypeAdapter, rows, headers : dict | None = None):
+    return Response(content = orm_json(adapter, rows), media_type = 'application/json', headers = headers)
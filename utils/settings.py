@@ -0,0 +1,134 @@
+import os
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRUE_VALUES = ("1", "true", "yes")
+
+
+# every setting the app reads, parsed once from the environment and .env; modules keep their
+# constants as aliases of these attributes so the names they export stay the same
+class Settings:
+    def __init__(self, env = os.environ):
+        self._env = env
+
+        self.database_url = self._str("DATABASE_URL", "mysql+pymysql://root:@127.0.0.1:3306/test")
+        self.async_database_url = self._str("ASYNC_DATABASE_URL")
+        self.alembic_ini = self._str("ALEMBIC_INI", os.path.join(ROOT, 'alembic.ini'))
+        self.db_schema_mode = self._str("DB_SCHEMA_MODE", "check")
+        self.db_echo = self._bool("DB_ECHO", False)
+        self.db_pool_size = self._int("DB_POOL_SIZE", 10)
+        self.db_max_overflow = self._int("DB_MAX_OVERFLOW", 20)
+        self.db_pool_timeout = self._float("DB_POOL_TIMEOUT", 30)
+        self.db_pool_recycle = self._int("DB_POOL_RECYCLE", 1800)
+        self.db_pool_pre_ping = self._bool("DB_POOL_PRE_PING", True)
+        self.database_replica_urls = self._list("DATABASE_REPLICA_URLS")
+        self.db_replica_strategy = self._str("DB_REPLICA_STRATEGY", "round_robin")
+        self.db_replica_retry_seconds = self._float("DB_REPLICA_RETRY_SECONDS", 30)
+        self.db_read_your_writes_seconds = self._float("DB_READ_YOUR_WRITES_SECONDS", 5)
+        self.db_read_your_writes_max_keys = self._int("DB_READ_YOUR_WRITES_MAX_KEYS", 100000)
+
+        self.auth_secret_key = self._str("AUTH_SECRET_KEY")
+        self.user_cache_size = self._int("USER_CACHE_SIZE", 10000)
+        self.user_cache_ttl = self._float("USER_CACHE_TTL", 60)
+        self.token_cache_size = self._int("TOKEN_CACHE_SIZE", 10000)
+        self.token_cache_ttl = self._float("TOKEN_CACHE_TTL", 300)
+        self.bcrypt_rounds = self._int("BCRYPT_ROUNDS", 12)
+        self.hash_workers = self._int("HASH_WORKERS", os.cpu_count() or 1)
+        self.hash_queue_limit = self._int("HASH_QUEUE_LIMIT", self.hash_workers * 4)
+        self.email_filter_enabled = self._bool("EMAIL_FILTER_ENABLED", True)
+        self.email_filter_capacity = self._int("EMAIL_FILTER_CAPACITY", 1000000)
+        self.email_filter_error_rate = self._float("EMAIL_FILTER_ERROR_RATE", 0.01)
+
+        self.paypal_api_base_url = self._str("PAYPAL_API_BASE_URL", "https://api-m.sandbox.paypal.com")
+        self.paypal_client_id = self._str("PAYPAL_CLIENT_ID")
+        self.paypal_secret_key = self._str("PAYPAL_SECRET_KEY")
+        self.paypal_access_token = self._str("PAYPAL_ACCESS_TOKEN")
+        self.paypal_timeout = self._float("PAYPAL_TIMEOUT", 15)
+        self.paypal_connect_timeout = self._float("PAYPAL_CONNECT_TIMEOUT", 5)
+        self.paypal_max_connections = self._int("PAYPAL_MAX_CONNECTIONS", 50)
+        self.paypal_max_keepalive = self._int("PAYPAL_MAX_KEEPALIVE", 20)
+        self.paypal_retries = self._int("PAYPAL_RETRIES", 3)
+        self.paypal_backoff = self._float("PAYPAL_BACKOFF", 0.25)
+        self.paypal_token_skew = self._float("PAYPAL_TOKEN_SKEW", 120)
+        self.paypal_return_url = self._str("PAYPAL_RETURN_URL", "http://localhost:8000/order/capture-order")
+        self.paypal_cancel_url = self._str("PAYPAL_CANCEL_URL", "http://localhost:8000/order/cancel-order")
+        self.checkout_reuse_minutes = self._int("CHECKOUT_REUSE_MINUTES", 60)
+        self.checkout_payload_cache_size = self._int("CHECKOUT_PAYLOAD_CACHE_SIZE", 10000)
+
+        self.capture_workers = self._int("CAPTURE_WORKERS", 4)
+        self.capture_max_attempts = self._int("CAPTURE_MAX_ATTEMPTS", 6)
+        self.capture_backoff = self._float("CAPTURE_BACKOFF", 2)
+        self.capture_backoff_max = self._float("CAPTURE_BACKOFF_MAX", 300)
+        self.capture_lease_seconds = self._float("CAPTURE_LEASE_SECONDS", 120)
+        self.capture_poll_interval = self._float("CAPTURE_POLL_INTERVAL", 1)
+        self.reaper_enabled = self._bool("REAPER_ENABLED", True)
+        self.reaper_interval = self._float("REAPER_INTERVAL", 300)
+        self.reaper_batch_size = self._int("REAPER_BATCH_SIZE", 500)
+        self.pending_order_ttl_minutes = self._int("PENDING_ORDER_TTL_MINUTES", 180)
+        self.archive_after_days = self._int("ARCHIVE_AFTER_DAYS", 0)
+        self.archive_statuses = self._list("ARCHIVE_STATUSES", "cancelled,failed,expired")
+
+        self.redis_url = self._str("REDIS_URL")
+        self.catalog_cache_backend = self._str("CATALOG_CACHE_BACKEND", "memory")
+        self.catalog_cache_size = self._int("CATALOG_CACHE_SIZE", 4096)
+        self.catalog_cache_ttl = self._float("CATALOG_CACHE_TTL", 300)
+        self.search_index_enabled = self._bool("SEARCH_INDEX_ENABLED", True)
+        self.search_min_prefix = self._int("SEARCH_MIN_PREFIX", 2)
+        self.search_max_candidates = self._int("SEARCH_MAX_CANDIDATES", 1000)
+        self.cache_sync_interval = self._float("CACHE_SYNC_INTERVAL", 1)
+        self.cache_sync_max_changes = self._int("CACHE_SYNC_MAX_CHANGES", 500)
+        self.cache_change_keep = self._int("CACHE_CHANGE_KEEP", 10000)
+        self.export_batch_size = self._int("EXPORT_BATCH_SIZE", 2000)
+
+        self.rate_limit_enabled = self._bool("RATE_LIMIT_ENABLED", True)
+        self.rate_limit_backend = self._str("RATE_LIMIT_BACKEND", "memory")
+        self.rate_limit_capacity = self._float("RATE_LIMIT_CAPACITY", 60)
+        self.rate_limit_refill_rate = self._float("RATE_LIMIT_REFILL_RATE", 10)
+        self.rate_limit_max_keys = self._int("RATE_LIMIT_MAX_KEYS", 100000)
+        self.rate_limit_trust_forwarded = self._bool("RATE_LIMIT_TRUST_FORWARDED", False)
+        self.rate_limit_auth_cost = self._float("RATE_LIMIT_AUTH_COST", 10)
+        self.rate_limit_checkout_cost = self._float("RATE_LIMIT_CHECKOUT_COST", 5)
+        self.rate_limit_search_cost = self._float("RATE_LIMIT_SEARCH_COST", 2)
+        self.router_concurrency_limit = self._int("ROUTER_CONCURRENCY_LIMIT", 64)
+
+        self.metrics_query_budget = self._int("METRICS_QUERY_BUDGET", 20)
+        self.metrics_token = self._str("METRICS_TOKEN")
+        self.profile_enabled = self._bool("PROFILE_ENABLED", False)
+        self.profile_sample_rate = self._float("PROFILE_SAMPLE_RATE", 0)
+        self.profile_slow_ms = self._float("PROFILE_SLOW_MS", 500)
+        self.profile_interval_ms = self._float("PROFILE_INTERVAL_MS", 5)
+        self.profile_dir = self._str("PROFILE_DIR", "profiles")
+        self.profile_keep = self._int("PROFILE_KEEP", 200)
+        self.profile_settings_file = self._str("PROFILE_SETTINGS_FILE", os.path.join(self.profile_dir, 'settings.json'))
+        self.profile_poll_interval = self._float("PROFILE_POLL_INTERVAL", 2)
+
+        self.serve_host = self._str("SERVE_HOST", "127.0.0.1")
+        self.serve_port = self._int("SERVE_PORT", 8000)
+        # proxies whose X-Forwarded-For replaces the peer address, see serve.py and client_key
+        self.forwarded_allow_ips = self._str("FORWARDED_ALLOW_IPS", "127.0.0.1,::1")
+        self.serve_workers = self._int("SERVE_WORKERS", os.cpu_count() or 1)
+        self.startup_budget_ms = self._float("STARTUP_BUDGET_MS", 1000)
+
+    def _str(self, name : str, default : str | None = None):
+        return self._env.get(name, default)
+
+    def _int(self, name : str, default : int):
+        return int(self._env.get(name, default))
+
+    def _float(self, name : str, default : float):
+        return float(self._env.get(name, default))
+
+    def _bool(self, name : str, default : bool):
+        value = self._env.get(name)
+        return default if value is None else value.lower() in TRUE_VALUES
+
+    def _list(self, name : str, default : str = ""):
+        return [item.strip() for item in self._env.get(name, default).split(',') if item.strip()]
+
+
+def load_settings():
+    load_dotenv()
+    return Settings()
+
+
+settings = load_settings()
@@ -0,0 +1,56 @@
+import logging
+from contextlib import contextmanager
+from time import perf_counter
+from utils.settings import settings
+
+STARTUP_BUDGET_MS = settings.startup_budget_ms
+
+logger = logging.getLogger(__name__)
+
+
+# how long this process took to become ready to serve, in ms; measured from the import of this
+# module, or from the fork when serve.py starts the worker from an already imported app
+class StartupTimer:
+    def __init__(self, budget_ms : float = STARTUP_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.started = perf_counter()
+        self.phases : dict[str, float] = {}
+        self.total_ms : float | None = None
+        self.on_ready = None
+
+    def restart(self):
+        self.started = perf_counter()
+        self.phases = {}
+        self.total_ms = None
+
+    def record(self, name : str, ms : float):
+        self.phases[name] = ms
+
+    @contextmanager
+    def phase(self, name : str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (perf_counter() - start) * 1000
+
+    def ready(self):
+        self.total_ms = (perf_counter() - self.started) * 1000
+        phases = ', '.join(f'{name} {ms:.0f}ms' for name, ms in self.phases.items())
+        if self.total_ms > self.budget_ms:
+            logger.warning('worker started in %.0fms, over the %.0fms budget (%s)', self.total_ms, self.budget_ms, phases)
+        else:
+            logger.info('worker started in %.0fms (%s)', self.total_ms, phases)
+        if self.on_ready is not None:
+            self.on_ready(self.stats())
+
+    def stats(self):
+        return {
+            'total_ms' : self.total_ms,
+            'budget_ms' : self.budget_ms,
+            'over_budget' : self.total_ms is not None and self.total_ms > self.budget_ms,
+            'phases_ms' : dict(self.phases),
+        }
+
+
+startup_timer = StartupTimer()